@@ -0,0 +1,97 @@
+import argparse
+import contextlib
+import itertools
+import json
+import os
+
+import torch
+
+from src.noisydataset import load_features
+from src.report import append_report, split_args
+from utils.config import get_config
+
+# Pick the batch sizes, torch threads and DataLoader workers of a dataset from short timed trials of the real
+# training step and evaluation encode of main_noisy.py (--benchmark_steps). The training batch size, threads
+# and workers are chosen for training throughput first, then the evaluation batch size for encode throughput;
+# trials above the memory cap or running out of memory are discarded. The best options are written to a JSON
+# file loaded with --config_file.
+#
+# python autotune.py --memory_cap 8000 -- --data_name xmedianet4view --loss MCE
+# python main_noisy.py --config_file autotune_xmedianet4view.json --data_name xmedianet4view --loss MCE ...
+parser = argparse.ArgumentParser(description='MRL throughput autotuner')
+parser.add_argument('--train_batch_sizes', type=int, nargs='+', default=[64, 100, 128, 256, 512])
+parser.add_argument('--eval_batch_sizes', type=int, nargs='+', default=[200, 500, 1000, 2000])
+parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, os.cpu_count() or 1])
+parser.add_argument('--num_workers', type=int, nargs='+', default=[0, 2, 4])
+parser.add_argument('--steps', type=int, default=20, help='timed training steps per trial')
+parser.add_argument('--memory_cap', type=float, default=0, help='peak GPU memory in MB, 0: no cap')
+parser.add_argument('--output', type=str, default='', help='best configuration, autotune_<data_name>.json by default')
+parser.add_argument('--report', type=str, default='autotune_report.csv')
+
+
+def trial(base_argv, features, options, steps):
+    import main_noisy
+    config = get_config(base_argv, benchmark_steps=steps, log_name='autotune', **options)
+    log_dir = os.path.join(config.root_dir, 'logs', config.log_name)
+    os.makedirs(log_dir, exist_ok=True)
+    try:
+        with open(os.path.join(log_dir, 'stdout.txt'), 'a') as f, contextlib.redirect_stdout(f):
+            return main_noisy.main(config, features)
+    except RuntimeError as e:
+        if 'out of memory' not in str(e):
+            raise
+        torch.cuda.empty_cache()
+        return None
+
+
+def main():
+    tune_args, base_argv = split_args(parser)
+    config = get_config(base_argv)
+    features = {mode: load_features(config.data_name, mode, storage=config.storage_dtype, sparse=config.sparse_text) for mode in ['train', 'valid', 'test']}
+    default_threads = torch.get_num_threads()
+
+    rows = []
+
+    def run(options, score):
+        result = trial(base_argv, features, options, tune_args.steps)
+        torch.set_num_threads(default_threads)
+        row = dict(options)
+        if result is None:
+            row.update(train_samples_per_s=0., eval_samples_per_s=0., peak_memory_MB=float('inf'), status='oom')
+        else:
+            row.update(result)
+            row['status'] = 'over_cap' if 0 < tune_args.memory_cap < result['peak_memory_MB'] else 'ok'
+        rows.append(row)
+        print('%s: train %8.0f samples/s | eval %8.0f samples/s | %8.1f MB | %s' % (
+            ' '.join('%s=%s' % kv for kv in options.items()), row['train_samples_per_s'], row['eval_samples_per_s'],
+            row['peak_memory_MB'], row['status']))
+        return row[score] if row['status'] == 'ok' else -1.
+
+    print('===> Tuning the training batch size, threads and workers ..')
+    best, best_score = None, -1.
+    for batch_size, threads, workers in itertools.product(tune_args.train_batch_sizes, sorted(set(tune_args.threads)), tune_args.num_workers):
+        options = {'train_batch_size': batch_size, 'eval_batch_size': config.eval_batch_size, 'threads': threads, 'num_workers': workers}
+        score = run(options, 'train_samples_per_s')
+        if score > best_score:
+            best, best_score = options, score
+    if best is None:
+        raise Exception('No configuration fits in %g MB.' % tune_args.memory_cap)
+
+    print('===> Tuning the evaluation batch size ..')
+    best_eval, best_eval_score = config.eval_batch_size, -1.
+    for batch_size in tune_args.eval_batch_sizes:
+        score = run(dict(best, eval_batch_size=batch_size), 'eval_samples_per_s')
+        if score > best_eval_score:
+            best_eval, best_eval_score = batch_size, score
+    best['eval_batch_size'] = best_eval
+
+    output = tune_args.output or 'autotune_%s.json' % config.data_name
+    with open(output, 'w') as f:
+        json.dump(best, f, indent=2)
+    print('Best: %s -> %s' % (json.dumps(best), output))
+
+    append_report(tune_args.report, [dict(data_name=config.data_name, **row) for row in rows])
+
+
+if __name__ == '__main__':
+    main()
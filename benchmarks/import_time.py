@@ -0,0 +1,66 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Cold-start latency of the library modules, each imported in a fresh interpreter as a worker process would.
+# An import must not print (e.g. parse the command line) and should stay under the budget.
+#
+# python benchmarks/import_time.py --repeat 5 --budget 3
+parser = argparse.ArgumentParser(description='import-time benchmark')
+parser.add_argument('--modules', nargs='+', default=['src.noisydataset', 'src.metrics', 'src.utils', 'nets', 'utils.config', 'main_noisy'])
+parser.add_argument('--repeat', type=int, default=5)
+parser.add_argument('--budget', type=float, default=0., help='fail if the median import time of a module exceeds this (seconds)')
+parser.add_argument('--detail', action='store_true', help='print the slowest imports reported by -X importtime')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def time_import(module):
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import %s' % module, '--bogus-argument'],
+                          cwd=ROOT, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise Exception('import %s failed: %s' % (module, proc.stderr.strip().splitlines()[-1]))
+    return elapsed, proc.stdout, proc.stderr
+
+
+def slowest(importtime, n=5):
+    rows = []
+    for line in importtime.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative), name.strip()))
+    return sorted(rows, reverse=True)[:n]
+
+
+def main():
+    args = parser.parse_args()
+    subprocess.run([sys.executable, '-c', 'pass'])  # warm the interpreter itself
+    failed = False
+    print('%-20s %10s %10s' % ('module', 'min (s)', 'median (s)'))
+    for module in args.modules:
+        times, stdout, stderr = [], '', ''
+        for _ in range(args.repeat):
+            elapsed, stdout, stderr = time_import(module)
+            times.append(elapsed)
+        median = statistics.median(times)
+        print('%-20s %10.3f %10.3f' % (module, min(times), median))
+        if stdout:
+            print('  side effect: importing %s printed %r' % (module, stdout[:80]))
+            failed = True
+        if args.budget > 0 and median > args.budget:
+            print('  over budget (%.3fs > %.3fs)' % (median, args.budget))
+            failed = True
+        if args.detail:
+            for cumulative, name in slowest(stderr):
+                print('  %8.3fs  %s' % (cumulative / 1e6, name))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
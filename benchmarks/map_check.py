@@ -0,0 +1,66 @@
+import argparse
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.metrics import EvalPlanner, average_precision, fx_calc_map_label  # noqa: E402
+
+# Randomized equivalence check of the MAP of src.metrics.average_precision against the reference
+# fx_calc_map_label(..., k=0), on splits with query classes missing from the gallery and with tied distances.
+# Ties within a class cannot change an AP and must match exactly; for ties between a relevant and a non-relevant
+# item average_precision ranks the relevant first, while the reference follows argsort, so it may only score higher.
+#
+# python benchmarks/map_check.py --trials 200
+parser = argparse.ArgumentParser(description='MAP equivalence check')
+parser.add_argument('--trials', type=int, default=100)
+parser.add_argument('--queries', type=int, default=60)
+parser.add_argument('--gallery', type=int, default=80)
+parser.add_argument('--classes', type=int, default=6)
+parser.add_argument('--dim', type=int, default=8)
+parser.add_argument('--seed', type=int, default=0)
+
+
+def split(rng, args, cross_class_ties):
+    gallery_label = rng.randint(args.classes, size=args.gallery)
+    test_label = rng.randint(args.classes + 2, size=args.queries)  # the last two classes are never in the gallery
+    gallery = rng.randn(args.gallery, args.dim)
+    test = rng.randn(args.queries, args.dim)
+    # duplicated gallery items are tied for every query
+    dup = rng.choice(args.gallery, args.gallery // 4, replace=False)
+    src = rng.randint(args.gallery, size=len(dup))
+    gallery[dup] = gallery[src]
+    if not cross_class_ties:
+        gallery_label[dup] = gallery_label[src]
+    # scaled copies of the gallery items as queries tie with them exactly under the cosine distance
+    copies = rng.choice(args.queries, args.queries // 4, replace=False)
+    test[copies] = 2. * gallery[rng.randint(args.gallery, size=len(copies))]
+    return test, test_label, gallery, gallery_label
+
+
+def main():
+    args = parser.parse_args()
+    import scipy.spatial
+    rng = np.random.RandomState(args.seed)
+    planner = EvalPlanner()
+    failed = 0
+    for trial in range(args.trials):
+        cross_class_ties = trial % 2 == 1
+        test, test_label, gallery, gallery_label = split(rng, args, cross_class_ties)
+        reference = fx_calc_map_label(gallery, gallery_label, test, test_label, k=0)[0]
+        dist = scipy.spatial.distance.cdist(test, gallery, 'cosine')
+        context = planner.context(test_label, gallery_label)
+        for chunk in [1, 7, 1024]:
+            value = average_precision(dist, test_label, gallery_label, chunk=chunk, context=context).mean()
+            ok = value >= reference - 1e-12 if cross_class_ties else abs(value - reference) <= 1e-12
+            if not ok:
+                failed += 1
+                print('trial %d, chunk %d, %s ties: MAP %.15f, reference %.15f' % (
+                    trial, chunk, 'cross-class' if cross_class_ties else 'in-class', value, reference))
+    print('%d trials, %d mismatches' % (args.trials, failed))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
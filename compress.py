@@ -0,0 +1,99 @@
+import argparse
+import copy
+import os
+
+import torch
+import torch.optim as optim
+
+import src.utils as utils
+from main_noisy import load_models
+from src.compress import evaluate, model_size, prune_hidden_units, quantize
+from src.metrics import EvalPlanner
+from src.noisydataset import cross_modal_dataset
+from src.report import append_report, split_args
+from utils.config import get_config
+
+# Compress the view encoders of a trained checkpoint for CPU inference: structured pruning of the hidden
+# units followed by a short fine-tune, and dynamic int8 quantization of the nn.Linear layers. Every variant is
+# evaluated on the test split and its MAP, size and CPU encode throughput are appended to the report.
+#
+# python compress.py --checkpoint ckpt/noisylabel/MRL_wiki_512_best_checkpoint.t7 --prune_ratios 0.5 0.75 \
+#     -- --data_name wiki --noisy_ratio 0.6 --loss MCE --beta 0.7 --lr 0.0001
+parser = argparse.ArgumentParser(description='MRL encoder compression')
+parser.add_argument('--checkpoint', type=str, required=True)
+parser.add_argument('--prune_ratios', type=float, nargs='*', default=[0.5, 0.75], help='ratios of hidden units to remove')
+parser.add_argument('--finetune_epochs', type=int, default=2)
+parser.add_argument('--save_dir', type=str, default='', help='save the pruned checkpoints here')
+parser.add_argument('--report', type=str, default='compress_report.csv')
+
+
+def finetune(multi_models, C, train_loader, config, class_num, epochs, device):
+    if config.loss == 'CE':
+        criterion = torch.nn.CrossEntropyLoss().to(device)
+    else:
+        criterion = utils.MeanClusteringError(class_num, tau=config.tau).to(device)
+    parameters = sum([list(m.parameters()) for m in multi_models], [])
+    optimizer = optim.Adam(parameters, lr=config.lr, betas=[0.5, 0.999], weight_decay=config.wd)
+    n_view = len(multi_models)
+    for m in multi_models:
+        m.train()
+    for epoch in range(epochs):
+        train_loss = 0.
+        for batch_idx, data in enumerate(train_loader):
+            batches, targets = [data[0][v].to(device) for v in range(n_view)], [data[1][v].to(device) for v in range(n_view)]
+            optimizer.zero_grad()
+            outputs = [multi_models[v](batches[v]) for v in range(n_view)]
+            loss = sum([criterion(outputs[v].mm(C), targets[v]) for v in range(n_view)])
+            loss = config.beta * loss + (1. - config.beta) * utils.cross_modal_contrastive_ctriterion(outputs, tau=config.tau)
+            loss.backward()
+            optimizer.step()
+            train_loss += loss.item()
+        print('  fine-tune epoch %d: loss %.4f' % (epoch, train_loss / len(train_loader)))
+
+
+def main():
+    compress_args, config_argv = split_args(parser)
+    config = get_config(config_argv)
+    if config.threads > 0:
+        torch.set_num_threads(config.threads)
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+
+    train_dataset = cross_modal_dataset(config.data_name, config.noisy_ratio, 'train', storage=config.storage_dtype)
+    test_dataset = cross_modal_dataset(config.data_name, config.noisy_ratio, 'test', storage=config.storage_dtype)
+    train_loader = torch.utils.data.DataLoader(train_dataset, batch_size=config.train_batch_size, num_workers=config.num_workers,
+                                               shuffle=True, pin_memory=True, drop_last=False)
+    n_view = len(train_dataset.train_data)
+    input_dims = [train_dataset.train_data[v].shape[1] for v in range(n_view)]
+
+    teacher, C = load_models(config, compress_args.checkpoint, input_dims)
+
+    planner = EvalPlanner(config.eval_processes)
+    variants = [('fp32', teacher), ('int8', [quantize(m) for m in teacher])]
+    for ratio in compress_args.prune_ratios:
+        print('===> Pruning %g of the hidden units ..' % ratio)
+        pruned = [prune_hidden_units(copy.deepcopy(m).to(device), ratio) for m in teacher]
+        finetune(pruned, C.to(device), train_loader, config, train_dataset.class_num, compress_args.finetune_epochs, device)
+        pruned = [m.cpu() for m in pruned]
+        if compress_args.save_dir:
+            os.makedirs(compress_args.save_dir, exist_ok=True)
+            state = {'model_state_dict_%d' % v: pruned[v].state_dict() for v in range(n_view)}
+            state['C'] = C
+            torch.save(state, os.path.join(compress_args.save_dir, 'MRL_%s_%d_pruned_%g.t7' % (config.data_name, config.output_dim, ratio)))
+        variants.append(('prune%g' % ratio, pruned))
+        variants.append(('prune%g+int8' % ratio, [quantize(m) for m in pruned]))
+
+    rows = []
+    for name, multi_models in variants:
+        MAP, speed = evaluate(multi_models, test_dataset, planner, config.eval_batch_size)
+        rows.append({'data_name': config.data_name, 'variant': name,
+                     'hidden': ' '.join('%dx%d' % (m.fc1.out_features, m.fc2.out_features) for m in multi_models),
+                     'size_MB': sum(model_size(m) for m in multi_models) / 2. ** 20,
+                     'samples_per_s': speed, 'MAP': MAP, 'delta_MAP': MAP - (rows[0]['MAP'] if rows else MAP)})
+        print('%-16s size %8.2f MB | %10.0f samples/s | MAP %.4f (%+.4f)' % (name, rows[-1]['size_MB'], speed, MAP, rows[-1]['delta_MAP']))
+    planner.close()
+
+    append_report(compress_args.report, rows)
+
+
+if __name__ == '__main__':
+    main()
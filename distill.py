@@ -0,0 +1,125 @@
+import argparse
+import copy
+import os
+
+import torch
+import torch.nn.functional as F
+import torch.optim as optim
+
+import src.utils as utils
+from main_noisy import build_models, load_models
+from src.compress import evaluate, model_size
+from src.metrics import EvalPlanner
+from src.noisydataset import cross_modal_dataset
+from src.report import append_report, split_args
+from utils.config import get_config
+from utils.bar_show import progress_bar
+
+# Distill the view encoders of a trained checkpoint into compact students (ImageNet/TextNet with a small
+# hidden width) that share the teacher's class prototypes C. The students are trained with the usual
+# robust clustering and multimodal contrastive losses plus an embedding-alignment loss and a distillation
+# loss on the C logits, and are saved in the model_state_dict_%d layout of main_noisy.py.
+#
+# python distill.py --checkpoint ckpt/noisylabel/MRL_wiki_512_best_checkpoint.t7 --student_mid_num 512 \
+#     -- --data_name wiki --noisy_ratio 0.6 --loss MCE --beta 0.7 --lr 0.0001
+parser = argparse.ArgumentParser(description='MRL encoder distillation')
+parser.add_argument('--checkpoint', type=str, required=True, help='teacher checkpoint')
+parser.add_argument('--student_mid_num', type=int, nargs='+', default=[512], help='hidden width of the students, or widths of fc1 and fc2')
+parser.add_argument('--epochs', type=int, default=30)
+parser.add_argument('--align', type=float, default=1., help='weight of the embedding-alignment loss')
+parser.add_argument('--kd', type=float, default=1., help='weight of the distillation loss on the C logits')
+parser.add_argument('--kd_tau', type=float, default=0.1, help='temperature of the distillation loss')
+parser.add_argument('--report', type=str, default='distill_report.csv')
+
+
+def main():
+    distill_args, config_argv = split_args(parser)
+    config = get_config(config_argv)
+    if config.threads > 0:
+        torch.set_num_threads(config.threads)
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    ckpt_dir = os.path.join(config.root_dir, 'ckpt', config.ckpt_dir)
+    os.makedirs(ckpt_dir, exist_ok=True)
+
+    train_dataset = cross_modal_dataset(config.data_name, config.noisy_ratio, 'train', storage=config.storage_dtype)
+    valid_dataset = cross_modal_dataset(config.data_name, config.noisy_ratio, 'valid', storage=config.storage_dtype)
+    test_dataset = cross_modal_dataset(config.data_name, config.noisy_ratio, 'test', storage=config.storage_dtype)
+    train_loader = torch.utils.data.DataLoader(train_dataset, batch_size=config.train_batch_size, num_workers=config.num_workers,
+                                               shuffle=True, pin_memory=True, drop_last=False)
+    n_view = len(train_dataset.train_data)
+    input_dims = [train_dataset.train_data[v].shape[1] for v in range(n_view)]
+
+    teacher, C = load_models(config, distill_args.checkpoint, input_dims)
+    teacher = [m.to(device).eval() for m in teacher]
+    C = C.to(device)
+    mid_num = distill_args.student_mid_num[0] if len(distill_args.student_mid_num) == 1 else tuple(distill_args.student_mid_num)
+    student = [m.to(device) for m in build_models(config, input_dims, [mid_num] * n_view)]
+
+    if config.loss == 'CE':
+        criterion = torch.nn.CrossEntropyLoss().to(device)
+    else:
+        criterion = utils.MeanClusteringError(train_dataset.class_num, tau=config.tau).to(device)
+    parameters = sum([list(m.parameters()) for m in student], [])
+    optimizer = optim.Adam(parameters, lr=config.lr, betas=[0.5, 0.999], weight_decay=config.wd)
+    lr_schedu = optim.lr_scheduler.CosineAnnealingLR(optimizer, distill_args.epochs, eta_min=0, last_epoch=-1)
+    planner = EvalPlanner(config.eval_processes)
+    kd_tau = distill_args.kd_tau
+
+    best_acc, best_state = -1., None
+    for epoch in range(distill_args.epochs):
+        print('\nEpoch: %d / %d' % (epoch, distill_args.epochs))
+        for m in student:
+            m.train()
+        train_loss = 0.
+        for batch_idx, data in enumerate(train_loader):
+            batches, targets = [data[0][v].to(device) for v in range(n_view)], [data[1][v].to(device) for v in range(n_view)]
+            with torch.no_grad():
+                t_outputs = [teacher[v](batches[v]) for v in range(n_view)]
+            outputs = [student[v](batches[v]) for v in range(n_view)]
+            preds = [outputs[v].mm(C) for v in range(n_view)]
+
+            loss = sum([criterion(preds[v], targets[v]) for v in range(n_view)])
+            loss = config.beta * loss + (1. - config.beta) * utils.cross_modal_contrastive_ctriterion(outputs, tau=config.tau)
+            # both embeddings are L2-normalized, align them by cosine similarity
+            align = sum([(1. - (outputs[v] * t_outputs[v]).sum(1)).mean() for v in range(n_view)])
+            kd = sum([F.kl_div(F.log_softmax(preds[v] / kd_tau, dim=1), F.softmax(t_outputs[v].mm(C) / kd_tau, dim=1),
+                               reduction='batchmean') * kd_tau ** 2 for v in range(n_view)])
+            loss = loss + distill_args.align * align + distill_args.kd * kd
+
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            train_loss += loss.item()
+            progress_bar(batch_idx, len(train_loader), 'Loss: %.3f | LR: %g' % (train_loss / (batch_idx + 1), optimizer.param_groups[0]['lr']))
+        lr_schedu.step()
+
+        cpu_student = [copy.deepcopy(m).cpu() for m in student]
+        val_avg, _ = evaluate(cpu_student, valid_dataset, planner, config.eval_batch_size)
+        print('Validation: Avg: %g' % val_avg)
+        if val_avg > best_acc:
+            best_acc = val_avg
+            best_state = [m.state_dict() for m in cpu_student]
+            state = {'model_state_dict_%d' % v: best_state[v] for v in range(n_view)}
+            state['epoch'] = epoch
+            state['C'] = C.cpu()
+            print('Saving..')
+            torch.save(state, os.path.join(ckpt_dir, '%s_%s_%d_student_checkpoint.t7' % ('MRL', config.data_name, config.output_dim)))
+
+    for v in range(n_view):
+        student[v].load_state_dict(best_state[v])
+    rows = []
+    for name, multi_models in [('teacher', teacher), ('student', student)]:
+        multi_models = [copy.deepcopy(m).cpu() for m in multi_models]
+        MAP, speed = evaluate(multi_models, test_dataset, planner, config.eval_batch_size)
+        rows.append({'data_name': config.data_name, 'model': name,
+                     'hidden': ' '.join('%dx%d' % (m.fc1.out_features, m.fc2.out_features) for m in multi_models),
+                     'size_MB': sum(model_size(m) for m in multi_models) / 2. ** 20,
+                     'samples_per_s': speed, 'MAP': MAP})
+        print('%-8s size %8.2f MB | %10.0f samples/s | Test MAP %.4f' % (name, rows[-1]['size_MB'], speed, MAP))
+    planner.close()
+
+    append_report(distill_args.report, rows)
+
+
+if __name__ == '__main__':
+    main()
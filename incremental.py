@@ -0,0 +1,162 @@
+import argparse
+import copy
+import json
+import os
+import time
+
+import torch
+import torch.optim as optim
+
+import src.utils as utils
+from main_noisy import load_models
+from src.cache import fingerprint
+from src.compress import evaluate
+from src.export import open_features
+from src.incremental import PairedDataset, class_balanced_indices, load_pairs
+from src.metrics import EvalPlanner
+from src.noisydataset import cross_modal_dataset
+from src.report import append_report, split_args
+from src.sparse import sparse_collate, to_tensor
+from utils.config import get_config
+from utils.bar_show import progress_bar
+
+# Fine-tune a trained checkpoint (encoders and C) on newly arrived noisily-labelled pairs instead of retraining from
+# scratch: the new samples are mixed with a bounded, class-balanced replay buffer drawn from the original training
+# set. Encoders of views left out of --train_views stay frozen, and only the embeddings of the views whose encoder
+# changed are re-encoded in an exported gallery (--export_format npy). The report compares the test MAP and the
+# time with the starting checkpoint and, if given, a full retrain on all the data.
+#
+# python incremental.py --checkpoint ckpt/noisylabel/MRL_wiki_512_best_checkpoint.t7 --new_data new_pairs.npz \
+#     --replay_size 2000 --gallery features/wiki_0.6 -- --data_name wiki --noisy_ratio 0.6 --loss MCE --beta 0.7
+parser = argparse.ArgumentParser(description='MRL incremental fine-tuning')
+parser.add_argument('--checkpoint', type=str, required=True)
+parser.add_argument('--new_data', type=str, required=True, help='.npz, .mat or HDF5 file with per-view arrays <view> and labels <view>_lab')
+parser.add_argument('--replay_size', type=int, default=2000, help='old training samples replayed, balanced over classes')
+parser.add_argument('--epochs', type=int, default=5)
+parser.add_argument('--train_views', nargs='*', default=[], help='views whose encoder is fine-tuned (default: all)')
+parser.add_argument('--gallery', type=str, default='', help='npy export to refresh in place')
+parser.add_argument('--output', type=str, default='', help='fine-tuned checkpoint, <checkpoint>_incremental.t7 by default')
+parser.add_argument('--reference', type=str, default='', help='checkpoint of a full retrain to compare with')
+parser.add_argument('--reference_time', type=float, default=0, help='training time of the full retrain in seconds')
+parser.add_argument('--seed', type=int, default=0)
+parser.add_argument('--report', type=str, default='incremental_report.csv')
+
+
+def refresh_gallery(path, multi_models, C, changed, config, batch_size):
+    """Re-encode in place the exported arrays of the views in changed, return the number of rows written."""
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    views = meta.get('views', config.views)
+    datasets, rows = {}, 0
+    for name in meta['arrays']:
+        if name == 'C':
+            array = open_features(path, name, 'r+')
+            array[:] = C.numpy()
+            array.flush()
+            continue
+        mode, view = name.split('/')
+        if view not in views or views.index(view) not in changed:
+            continue
+        v = views.index(view)
+        if mode not in datasets:
+            datasets[mode] = cross_modal_dataset(config.data_name, config.noisy_ratio, mode, storage=config.storage_dtype,
+                                                 sparse=config.sparse_text)
+        features, array = datasets[mode].train_data[v], open_features(path, name, 'r+')
+        with torch.no_grad():
+            for ct in range(0, features.shape[0], batch_size):
+                array[ct: ct + batch_size] = multi_models[v](to_tensor(features[ct: ct + batch_size])).numpy()
+        array.flush()
+        rows += features.shape[0]
+    return rows
+
+
+def main():
+    inc_args, config_argv = split_args(parser)
+    config = get_config(config_argv)
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+
+    train_dataset = cross_modal_dataset(config.data_name, config.noisy_ratio, 'train', storage=config.storage_dtype, sparse=config.sparse_text)
+    test_dataset = cross_modal_dataset(config.data_name, config.noisy_ratio, 'test', storage=config.storage_dtype, sparse=config.sparse_text)
+    n_view = len(train_dataset.train_data)
+    input_dims = [train_dataset.train_data[v].shape[1] for v in range(n_view)]
+
+    new = PairedDataset(*load_pairs(inc_args.new_data, config.views[: n_view]))
+    if len(new.train_data) != n_view:
+        raise Exception('%s should hold the views %s.' % (inc_args.new_data, ', '.join(config.views[: n_view])))
+    if max(lab.max() for lab in new.noise_label) >= train_dataset.class_num:
+        raise Exception('The new samples have classes unknown to C.')
+    old = PairedDataset(train_dataset.train_data, train_dataset.noise_label)
+    replay = old.subset(class_balanced_indices(old.noise_label[0], inc_args.replay_size, inc_args.seed))
+    dataset = PairedDataset.concat([new, replay])
+    loader = torch.utils.data.DataLoader(dataset, batch_size=config.train_batch_size, num_workers=config.num_workers, shuffle=True,
+                                         collate_fn=sparse_collate if config.sparse_text else None, drop_last=False)
+    print('===> %d new samples + %d replayed of %d' % (len(new), len(replay), len(old)))
+
+    multi_models, C = load_models(config, inc_args.checkpoint, input_dims)
+    planner = EvalPlanner(config.eval_processes)
+    before, _ = evaluate(multi_models, test_dataset, planner, config.eval_batch_size)
+    fingerprints = [fingerprint(m.state_dict()) for m in multi_models]
+
+    train_views = [v for v in range(n_view) if not inc_args.train_views or config.views[v] in inc_args.train_views]
+    multi_models = [m.to(device) for m in multi_models]
+    C = C.to(device).requires_grad_()
+    parameters = [C] + sum([list(multi_models[v].parameters()) for v in train_views], [])
+    for v in range(n_view):
+        multi_models[v].requires_grad_(v in train_views)
+    optimizer = optim.Adam(parameters, lr=config.lr, betas=[0.5, 0.999], weight_decay=config.wd)
+    if config.loss == 'CE':
+        criterion = torch.nn.CrossEntropyLoss().to(device)
+    else:
+        criterion = utils.MeanClusteringError(train_dataset.class_num, tau=config.tau).to(device)
+
+    start = time.time()
+    for epoch in range(inc_args.epochs):
+        print('\nEpoch: %d / %d' % (epoch, inc_args.epochs))
+        for v in range(n_view):
+            multi_models[v].train(v in train_views)
+        train_loss = 0.
+        for batch_idx, data in enumerate(loader):
+            batches, targets = [data[0][v].to(device) for v in range(n_view)], [data[1][v].to(device) for v in range(n_view)]
+            C.data = (C / C.norm(dim=0, keepdim=True)).detach()
+            optimizer.zero_grad()
+            outputs = [multi_models[v](batches[v]) for v in range(n_view)]
+            loss = sum([criterion(outputs[v].mm(C), targets[v]) for v in range(n_view)])
+            loss = config.beta * loss + (1. - config.beta) * utils.cross_modal_contrastive_ctriterion(outputs, tau=config.tau)
+            loss.backward()
+            optimizer.step()
+            train_loss += loss.item()
+            progress_bar(batch_idx, len(loader), 'Loss: %.3f' % (train_loss / (batch_idx + 1)))
+    elapsed = time.time() - start
+
+    multi_models = [copy.deepcopy(m).cpu().eval() for m in multi_models]
+    C = C.detach().cpu()
+    after, _ = evaluate(multi_models, test_dataset, planner, config.eval_batch_size)
+    output = inc_args.output or os.path.splitext(inc_args.checkpoint)[0] + '_incremental.t7'
+    state = {'model_state_dict_%d' % v: multi_models[v].state_dict() for v in range(n_view)}
+    state['C'] = C
+    state['avg'] = after
+    torch.save(state, output)
+
+    changed = [v for v in range(n_view) if fingerprint(multi_models[v].state_dict()) != fingerprints[v]]
+    refreshed = 0
+    if inc_args.gallery:
+        refreshed = refresh_gallery(inc_args.gallery, multi_models, C, changed, config, config.eval_batch_size)
+        print('Refreshed %d gallery embeddings of %s' % (refreshed, ', '.join(config.views[v] for v in changed) or 'no view'))
+
+    rows = [{'model': 'checkpoint', 'MAP': before, 'time_s': 0.},
+            {'model': 'incremental', 'MAP': after, 'time_s': elapsed}]
+    if inc_args.reference:
+        reference, _ = load_models(config, inc_args.reference, input_dims)
+        rows.append({'model': 'full_retrain', 'MAP': evaluate(reference, test_dataset, planner, config.eval_batch_size)[0],
+                     'time_s': inc_args.reference_time})
+    planner.close()
+    for row in rows:
+        row.update(data_name=config.data_name, new_samples=len(new), replay=len(replay), refreshed=refreshed,
+                   delta_MAP=row['MAP'] - rows[-1]['MAP'], speedup=rows[-1]['time_s'] / row['time_s'] if row['time_s'] > 0 else 0.)
+        print('%-12s MAP %.4f (%+.4f vs %s) | %8.1f s' % (row['model'], row['MAP'], row['delta_MAP'], rows[-1]['model'], row['time_s']))
+
+    append_report(inc_args.report, rows)
+
+
+if __name__ == '__main__':
+    main()
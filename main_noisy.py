@@ -6,28 +6,30 @@ import torch
 # import os
 # # os.environ['CUDA_VISIBLE_DEVICES'] = '1'
 # import torch
-from utils.config import args
+import copy
+import time
+from utils.config import get_config
 import torch.optim as optim
 import torch.backends.cudnn as cudnn
-from torch.utils.tensorboard import SummaryWriter
-cudnn.benchmark = True
 import nets as models
 from utils.bar_show import progress_bar
 from src.noisydataset import cross_modal_dataset
+from src.streaming import cross_modal_stream
+from src.sparse import sparse_collate, to_tensor
+from src.selection import SampleSelector
+from src.memory_bank import MemoryBank
+from src.cache import EmbeddingCache, fingerprint, split_key
+from src.export import FeatureWriter
+from src.slim import save_slim
+from src.async_eval import AsyncEvaluator
 import src.utils as utils
-import scipy
-import scipy.spatial
+from src.metrics import EvalPlanner, fx_calc_map_label, fx_calc_map_multilabel_k
 
 
+args = None  # set by main()
 best_acc = 0  # best test accuracy
 start_epoch = 0
 
-args.log_dir = os.path.join(args.root_dir, 'logs', args.log_name)
-args.ckpt_dir = os.path.join(args.root_dir, 'ckpt', args.ckpt_dir)
-
-os.makedirs(args.log_dir, exist_ok=True)
-os.makedirs(args.ckpt_dir, exist_ok=True)
-
 def load_dict(model, path):
     chp = torch.load(path)
     state_dict = model.state_dict()
@@ -36,49 +38,108 @@ def load_dict(model, path):
             state_dict[key] = chp['model_state_dict'][key]
     model.load_state_dict(state_dict)
 
-def main():
+def build_models(config, input_dims, mid_nums=None):
+    """
+    One encoder per view, ImageNet for images and TextNet for text.
+    :param mid_nums: per-view hidden widths (e.g. of pruned checkpoints), config.mid_num if None
+    """
+    multi_models = []
+    for v in range(len(input_dims)):
+        mid_num = config.mid_num if mid_nums is None else mid_nums[v]
+        if v == config.views.index('Img'): # Images
+            multi_models.append(models.__dict__['ImageNet'](input_dim=input_dims[v], output_dim=config.output_dim, mid_num=mid_num))
+        elif v == config.views.index('Txt'): # Text
+            multi_models.append(models.__dict__['TextNet'](input_dim=input_dims[v], output_dim=config.output_dim, mid_num=mid_num))
+        else: # Default to use ImageNet
+            multi_models.append(models.__dict__['ImageNet'](input_dim=input_dims[v], output_dim=config.output_dim, mid_num=mid_num))
+    return multi_models
+
+def load_models(config, path, input_dims):
+    """
+    Build the encoders of a checkpoint in the model_state_dict_%d layout, whatever their hidden widths,
+    and return them with the class prototypes C, on the CPU. A .slim path is loaded with src.slim.load_slim.
+    """
+    from src.compress import hidden_widths
+    if path.endswith('.slim'):
+        from src.slim import load_slim
+        multi_models, C, _ = load_slim(path, torch.float32)
+        return multi_models, C
+    ckpt = torch.load(path, map_location='cpu')
+    state_dicts = [ckpt['model_state_dict_%d' % v] for v in range(len(input_dims))]
+    multi_models = build_models(config, input_dims, [hidden_widths(sd) for sd in state_dicts])
+    for v in range(len(input_dims)):
+        multi_models[v].load_state_dict(state_dicts[v])
+    return multi_models, ckpt['C'].detach()
+
+def main(config=None, features=None):
+    """
+    :param config: run configuration from utils.config.get_config(), the command line if None
+    :param features: optional {mode: (train_data, train_label)} of preloaded features
+    """
+    global args, best_acc
+    from torch.utils.tensorboard import SummaryWriter
+    args = copy.copy(get_config() if config is None else config)
+    print(args)
+    args.log_dir = os.path.join(args.root_dir, 'logs', args.log_name)
+    args.ckpt_dir = os.path.join(args.root_dir, 'ckpt', args.ckpt_dir)
+    os.makedirs(args.log_dir, exist_ok=True)
+    os.makedirs(args.ckpt_dir, exist_ok=True)
+    cudnn.benchmark = True
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+
+    best_acc = 0
+    features = {} if features is None else features
     print('===> Preparing data ..')
-    train_dataset = cross_modal_dataset(args.data_name, args.noisy_ratio, 'train')
+    # benchmark trials keep the loader workers alive, so that their startup is not timed with the steps
+    persistent = args.num_workers > 0 and args.benchmark_steps > 0
+    if args.streaming:
+        train_dataset = cross_modal_stream(args.data_name, args.noisy_ratio, chunk_size=args.stream_chunk_size,
+                                           shuffle_buffer=args.stream_buffer, read_ahead=args.stream_read_ahead)
+    else:
+        train_dataset = cross_modal_dataset(args.data_name, args.noisy_ratio, 'train', features=features.get('train'), storage=args.storage_dtype,
+                                            sparse=args.sparse_text)
     train_loader = torch.utils.data.DataLoader(
         train_dataset,
         # sampler=sampler,
         batch_size=args.train_batch_size,
         num_workers=args.num_workers,
-        shuffle=True,
-        pin_memory=True,
+        shuffle=not args.streaming,
+        pin_memory=not args.sparse_text,
+        collate_fn=sparse_collate if args.sparse_text else None,
+        persistent_workers=persistent,
         drop_last=False
     )
 
-    valid_dataset = cross_modal_dataset(args.data_name, args.noisy_ratio, 'valid')
+    valid_dataset = cross_modal_dataset(args.data_name, args.noisy_ratio, 'valid', features=features.get('valid'), storage=args.storage_dtype,
+                                        sparse=args.sparse_text)
     valid_loader = torch.utils.data.DataLoader(
         valid_dataset,
         batch_size=args.eval_batch_size,
         num_workers=args.num_workers,
-        pin_memory=True,
+        pin_memory=not args.sparse_text,
+        collate_fn=sparse_collate if args.sparse_text else None,
+        persistent_workers=persistent,
         shuffle=False,
         drop_last=False
     )
 
-    test_dataset = cross_modal_dataset(args.data_name, args.noisy_ratio, 'test')
+    test_dataset = cross_modal_dataset(args.data_name, args.noisy_ratio, 'test', features=features.get('test'), storage=args.storage_dtype,
+                                       sparse=args.sparse_text)
     test_loader = torch.utils.data.DataLoader(
         test_dataset,
         batch_size=args.eval_batch_size,
         num_workers=args.num_workers,
-        pin_memory=True,
+        pin_memory=not args.sparse_text,
+        collate_fn=sparse_collate if args.sparse_text else None,
+        persistent_workers=persistent,
         shuffle=False,
         drop_last=False
     )
 
     print('===> Building Models..')
-    multi_models = []
     n_view = len(train_dataset.train_data)
-    for v in range(n_view):
-        if v == args.views.index('Img'): # Images
-            multi_models.append(models.__dict__['ImageNet'](input_dim=train_dataset.train_data[v].shape[1], output_dim=args.output_dim).cuda())
-        elif v == args.views.index('Txt'): # Text
-            multi_models.append(models.__dict__['TextNet'](input_dim=train_dataset.train_data[v].shape[1], output_dim=args.output_dim).cuda())
-        else: # Default to use ImageNet
-            multi_models.append(models.__dict__['ImageNet'](input_dim=train_dataset.train_data[v].shape[1], output_dim=args.output_dim).cuda())
+    multi_models = [m.cuda() for m in build_models(args, [train_dataset.train_data[v].shape[1] for v in range(n_view)])]
 
     C = torch.Tensor(args.output_dim, args.output_dim)
     C = torch.nn.init.orthogonal(C, gain=1)[:, 0: train_dataset.class_num].cuda()
@@ -101,11 +162,20 @@ def main():
 
     if args.loss == 'CE':
         criterion = torch.nn.CrossEntropyLoss().cuda()
+        sample_criterion = torch.nn.CrossEntropyLoss(reduction='none').cuda()
     elif args.loss == 'MCE':
         criterion = utils.MeanClusteringError(train_dataset.class_num, tau=args.tau).cuda()
+        sample_criterion = utils.MeanClusteringError(train_dataset.class_num, tau=args.tau, reduction='none').cuda()
     else:
         raise Exception('No such loss function.')
 
+    planner = EvalPlanner(args.eval_processes)
+    embedding_cache = EmbeddingCache(args.embedding_cache, args.embedding_cache_dir)
+    memory_bank = MemoryBank(n_view, args.bank_size, args.output_dim, args.bank_staleness).cuda() if args.bank_size > 0 else None
+    if args.streaming and args.select_interval > 0:
+        raise Exception('Sample selection needs an in-memory training set.')
+    selector = SampleSelector(n_view, len(train_dataset), momentum=args.select_momentum) if args.select_interval > 0 else None
+
     summary_writer = SummaryWriter(args.log_dir)
 
     if args.resume:
@@ -119,6 +189,15 @@ def main():
         start_epoch = 0
         print('===> Start from scratch')
 
+    num_steps = 0  # optimizer steps, the encoders only change with it
+    fingerprints = {}
+
+    def view_fingerprint(v):
+        # hash the weights once per update, shared by all the splits encoded until the next one
+        if v not in fingerprints or fingerprints[v][0] != num_steps:
+            fingerprints[v] = (num_steps, fingerprint(multi_models[v].state_dict()))
+        return fingerprints[v][1]
+
     def set_train():
         for v in range(n_view):
             multi_models[v].train()
@@ -127,28 +206,19 @@ def main():
         for v in range(n_view):
             multi_models[v].eval()
 
-    def cross_modal_contrastive_ctriterion(fea, tau=1.):
-        batch_size = fea[0].shape[0]
-        all_fea = torch.cat(fea)
-        sim = all_fea.mm(all_fea.t())
-
-        sim = (sim / tau).exp()
-        sim = sim - sim.diag().diag()
-        sim_sum1 = sum([sim[:, v * batch_size: (v + 1) * batch_size] for v in range(n_view)])
-        diag1 = torch.cat([sim_sum1[v * batch_size: (v + 1) * batch_size].diag() for v in range(n_view)])
-        loss1 = -(diag1 / sim.sum(1)).log().mean()
-
-        sim_sum2 = sum([sim[v * batch_size: (v + 1) * batch_size] for v in range(n_view)])
-        diag2 = torch.cat([sim_sum2[:, v * batch_size: (v + 1) * batch_size].diag() for v in range(n_view)])
-        loss2 = -(diag2 / sim.sum(1)).log().mean()
-        return loss1 + loss2
-
-    def train(epoch):
+    def train(epoch, max_steps=0):
+        nonlocal num_steps
         print('\nEpoch: %d / %d' % (epoch, args.max_epochs))
         set_train()
+        if args.streaming:
+            train_dataset.set_epoch(epoch)
         train_loss, loss_list, correct_list, total_list = 0., [0.] * n_view, [0.] * n_view, [0.] * n_view
 
-        for batch_idx, (batches, targets, index) in enumerate(train_loader):
+        for batch_idx, data in enumerate(train_loader):
+            if max_steps > 0 and batch_idx >= max_steps:
+                break
+            # the 'labeled' subset set by select() also yields the clean probabilities
+            batches, targets, index = data[0], data[1], data[-1]
             batches, targets = [batches[v].cuda() for v in range(n_view)], [targets[v].cuda() for v in range(n_view)]
             norm = C.norm(dim=0, keepdim=True)
             C.data = (C / norm).detach()
@@ -159,12 +229,27 @@ def main():
 
             outputs = [multi_models[v](batches[v]) for v in range(n_view)]
             preds = [outputs[v].mm(C) for v in range(n_view)]
-            losses = [criterion(preds[v], targets[v]) for v in range(n_view)]
+            if selector is None:
+                losses = [criterion(preds[v], targets[v]) for v in range(n_view)]
+            else:
+                losses = [sample_criterion(preds[v], targets[v]) for v in range(n_view)]
+                for v in range(n_view):
+                    selector.update(v, index.numpy(), losses[v].detach().cpu().numpy())
+                losses = [losses[v].mean() for v in range(n_view)]
             loss = sum(losses)
-            loss = args.beta * loss + (1. - args.beta) * cross_modal_contrastive_ctriterion(outputs, tau=args.tau)
+            if memory_bank is not None:
+                # bank entries are keyed by the position in the full training set
+                index = torch.from_numpy(selector.active[index.numpy()]) if selector is not None else index
+                index = index.cuda()
+            loss = args.beta * loss + (1. - args.beta) * utils.cross_modal_contrastive_ctriterion(outputs, tau=args.tau, memory_bank=memory_bank, index=index)
+            for dim in args.nested_dims:  # prefixes of the embedding usable on their own, see nested.py
+                loss = loss + utils.nested_loss(outputs, C, targets, dim, criterion, args.beta, args.tau)
             if epoch >= 0:
                 loss.backward()
                 optimizer.step()
+                num_steps += 1
+            if memory_bank is not None:
+                memory_bank.enqueue(outputs, index)
             train_loss += loss.item()
 
             for v in range(n_view):
@@ -181,89 +266,127 @@ def main():
         summary_writer.add_scalars('Loss/train', train_dict, epoch)
         summary_writer.add_scalars('Accuracy/train', {'view_%d_acc': correct_list[v] / total_list[v] for v in range(n_view)}, epoch)
 
-    def eval(data_loader, epoch, mode='test'):
-        fea, lab = [[] for _ in range(n_view)], [[] for _ in range(n_view)]
-        test_loss, loss_list, correct_list, total_list = 0., [0.] * n_view, [0.] * n_view, [0.] * n_view
+    def encode(data_loader, mode, cache=True):
+        # features only depend on the view's weights and the split, re-encode only what changed
+        dataset = data_loader.dataset
+        lab = [np.asarray(dataset.noise_label[v]).astype('int64') for v in range(n_view)]
+        if cache:
+            split = split_key(args.data_name, mode, lab)
+            keys = [(split, v, view_fingerprint(v)) for v in range(n_view)]
+            fea = [embedding_cache.get(key) for key in keys]
+        else:
+            fea = [None] * n_view
+        todo = [v for v in range(n_view) if fea[v] is None]
+        if len(todo) == 0:
+            return fea, lab
+        outputs = [[] for _ in range(n_view)]
         with torch.no_grad():
-            if sum([data_loader.dataset.train_data[v].shape[0] != data_loader.dataset.train_data[0].shape[0] for v in range(len(data_loader.dataset.train_data))]) == 0:
-                for batch_idx, (batches, targets, index) in enumerate(data_loader):
-                    batches, targets = [batches[v].cuda() for v in range(n_view)], [targets[v].cuda() for v in range(n_view)]
-                    outputs = [multi_models[v](batches[v]) for v in range(n_view)]
-                    pred, losses = [], []
-                    for v in range(n_view):
-                        fea[v].append(outputs[v])
-                        lab[v].append(targets[v])
-                        pred.append(outputs[v].mm(C))
-                        losses.append(criterion(pred[v], targets[v]))
-                        loss_list[v] += losses[v]
-                        _, predicted = pred[v].max(1)
-                        total_list[v] += targets[v].size(0)
-                        acc = predicted.eq(targets[v]).sum().item()
-                        correct_list[v] += acc
-                    loss = sum(losses)
-                    test_loss += loss.item()
+            # the features must follow dataset order, as lab does: a shuffled (or streamed) loader is read view by view instead
+            if sum([dataset.train_data[v].shape[0] != dataset.train_data[0].shape[0] for v in range(len(dataset.train_data))]) == 0 \
+                    and isinstance(data_loader.sampler, torch.utils.data.SequentialSampler):
+                for batch_idx, data in enumerate(data_loader):
+                    for v in todo:
+                        outputs[v].append(multi_models[v](data[0][v].cuda()).cpu())
             else:
-                pred, losses = [], []
-                for v in range(n_view):
-                    count = int(np.ceil(data_loader.dataset.train_data[v].shape[0]) / data_loader.batch_size)
-                    for ct in range(count):
-                        batch, targets = torch.Tensor(data_loader.dataset.train_data[v][ct * data_loader.batch_size: (ct + 1) * data_loader.batch_size]).cuda(), torch.Tensor(data_loader.dataset.noise_label[v][ct * data_loader.batch_size: (ct + 1) * data_loader.batch_size]).long().cuda()
-                        outputs = multi_models[v](batch)
-
-                        fea[v].append(outputs)
-                        lab[v].append(targets)
-                        pred.append(outputs.mm(C))
-                        losses.append(criterion(pred[v], targets))
-                        loss_list[v] += losses[v]
-                        _, predicted = pred[v].max(1)
-                        total_list[v] += targets.size(0)
-                        acc = predicted.eq(targets).sum().item()
-                        correct_list[v] += acc
-                    loss = sum(losses)
-                    test_loss += loss.item()
-
-            fea = [torch.cat(fea[v]).cpu().detach().numpy() for v in range(n_view)]
-            lab = [torch.cat(lab[v]).cpu().detach().numpy() for v in range(n_view)]
+                for v in todo:
+                    for ct in range(0, dataset.train_data[v].shape[0], data_loader.batch_size):
+                        batch = to_tensor(dataset.train_data[v][ct: ct + data_loader.batch_size]).cuda()
+                        outputs[v].append(multi_models[v](batch).cpu())
+        for v in todo:
+            fea[v] = torch.cat(outputs[v]).numpy()
+            if cache:
+                embedding_cache.put(keys[v], fea[v])
+        return fea, lab
+
+    def eval(data_loader, epoch, mode='test'):
+        fea, lab = encode(data_loader, mode)
+        loss_list, correct_list, total_list = [0.] * n_view, [0.] * n_view, [0.] * n_view
+        with torch.no_grad():
+            for v in range(n_view):
+                for ct in range(0, fea[v].shape[0], data_loader.batch_size):
+                    outputs = torch.from_numpy(fea[v][ct: ct + data_loader.batch_size]).cuda()
+                    targets = torch.from_numpy(lab[v][ct: ct + data_loader.batch_size]).cuda()
+                    pred = outputs.mm(C)
+                    loss_list[v] += criterion(pred, targets).item()
+                    _, predicted = pred.max(1)
+                    total_list[v] += targets.size(0)
+                    correct_list[v] += predicted.eq(targets).sum().item()
         test_dict = {('view_%d_loss' % v): loss_list[v] / len(data_loader) for v in range(n_view)}
-        test_dict['sum_loss'] = test_loss / len(data_loader)
+        test_dict['sum_loss'] = sum(loss_list) / len(data_loader)
         summary_writer.add_scalars('Loss/' + mode, test_dict, epoch)
 
         summary_writer.add_scalars('Accuracy/' + mode, {('view_%d_acc' % v): correct_list[v] / total_list[v] for v in range(n_view)}, epoch)
         return fea, lab
 
+    def export(writer, data_loader, mode):
+        # encode and write one batch at a time, the split is never held in memory
+        dataset = data_loader.dataset
+        set_eval()
+        with torch.no_grad():
+            for v in range(n_view):
+                name = '%s/%s' % (mode, args.views[v])
+                num = dataset.train_data[v].shape[0]
+                writer.create(name, (num, args.output_dim))
+                for ct in range(0, num, data_loader.batch_size):
+                    batch = to_tensor(dataset.train_data[v][ct: ct + data_loader.batch_size]).cuda()
+                    writer.write(name, ct, multi_models[v](batch).cpu().numpy())
+                writer.save(name + '_lab', np.asarray(dataset.noise_label[v]).astype('int64'))
+
+    def select(epoch):
+        set_eval()
+        # samples left out of the last selection have not been scored since, refresh them
+        inactive = selector.inactive()
+        with torch.no_grad():
+            for v in range(n_view):
+                for b in range(0, len(inactive), args.eval_batch_size):
+                    idx = inactive[b: b + args.eval_batch_size]
+                    batch = to_tensor(train_dataset.default_train_data[v][idx]).cuda()
+                    targets = torch.from_numpy(train_dataset.default_noise_label[v][idx]).cuda()
+                    losses = sample_criterion(multi_models[v](batch).mm(C), targets)
+                    selector.update(v, idx, losses.cpu().numpy(), active=False)
+        pred, prob = selector.select(args.select_threshold)
+        if len(selector.active) == 0:
+            selector.active = np.arange(len(train_dataset.default_train_data[0]))
+            train_dataset.reset(None, None)
+        else:
+            train_dataset.reset(pred, prob, 'labeled')
+        ratio = len(selector.active) / float(len(train_dataset.default_train_data[0]))
+        print('Selected %d clean samples (%.1f%%)' % (len(selector.active), 100. * ratio))
+        summary_writer.add_scalar('Selection/ratio', ratio, epoch)
+
     def multiview_test(fea, lab):
-        MAPs = np.zeros([n_view, n_view])
+        MAPs = planner(fea, lab)
         val_dict = {}
         print_str = ''
         for i in range(n_view):
             for j in range(n_view):
                 if i == j:
                     continue
-                MAPs[i, j] = fx_calc_map_label(fea[j], lab[j], fea[i], lab[i], k=0, metric='cosine')[0]
                 key = '%s2%s' % (args.views[i], args.views[j])
                 val_dict[key] = MAPs[i, j]
                 print_str = print_str + key + ': %.3f\t' % val_dict[key]
+        val_dict['avg'] = MAPs.sum() / n_view / (n_view - 1.)
         return val_dict, print_str
 
     def test(epoch):
             global best_acc
             set_eval()
             # switch to evaluate mode
-            fea, lab = eval(train_loader, epoch, 'train')
+            if not args.streaming:  # all-pairs retrieval over a corpus larger than RAM is out of reach
+                fea, lab = eval(train_loader, epoch, 'train')
 
-            MAPs = np.zeros([n_view, n_view])
-            train_dict = {}
-            for i in range(n_view):
-                for j in range(n_view):
-                    MAPs[i, j] = fx_calc_map_label(fea[j], lab[j], fea[i], lab[i], k=0, metric='cosine')[0]
-                    train_dict['%s2%s' % (args.views[i], args.views[j])] = MAPs[i, j]
+                MAPs = planner(fea, lab, include_self=True)
+                train_dict = {}
+                for i in range(n_view):
+                    for j in range(n_view):
+                        train_dict['%s2%s' % (args.views[i], args.views[j])] = MAPs[i, j]
 
-            train_avg = MAPs.sum() / n_view / (n_view - 1.)
-            train_dict['avg'] = train_avg
-            summary_writer.add_scalars('Retrieval/train', train_dict, epoch)
+                train_avg = MAPs.sum() / n_view / (n_view - 1.)
+                train_dict['avg'] = train_avg
+                summary_writer.add_scalars('Retrieval/train', train_dict, epoch)
 
             fea, lab = eval(valid_loader, epoch, 'valid')
-            MAPs = np.zeros([n_view, n_view])
+            MAPs = planner(fea, lab)
             val_dict = {}
             print_val_str = 'Validation: '
 
@@ -271,7 +394,6 @@ def main():
                 for j in range(n_view):
                     if i == j:
                         continue
-                    MAPs[i, j] = fx_calc_map_label(fea[j], lab[j], fea[i], lab[i], k=0, metric='cosine')[0]
                     key = '%s2%s' % (args.views[i], args.views[j])
                     val_dict[key] = MAPs[i, j]
                     print_val_str = print_val_str + key +': %g\t' % val_dict[key]
@@ -283,14 +405,13 @@ def main():
             summary_writer.add_scalars('Retrieval/valid', val_dict, epoch)
 
             fea, lab = eval(test_loader, epoch, 'test')
-            MAPs = np.zeros([n_view, n_view])
+            MAPs = planner(fea, lab)
             test_dict = {}
             print_test_str = 'Test: '
             for i in range(n_view):
                 for j in range(n_view):
                     if i == j:
                         continue
-                    MAPs[i, j] = fx_calc_map_label(fea[j], lab[j], fea[i], lab[i], k=0, metric='cosine')[0]
                     key = '%s2%s' % (args.views[i], args.views[j])
                     test_dict[key] = MAPs[i, j]
                     print_test_str = print_test_str + key + ': %g\t' % test_dict[key]
@@ -315,20 +436,99 @@ def main():
                 state['optimizer_state_dict'] = optimizer.state_dict()
                 state['C'] = C
                 torch.save(state, os.path.join(args.ckpt_dir, '%s_%s_%d_best_checkpoint.t7' % ('MRL', args.data_name, args.output_dim)))
+                if args.slim_dtype:
+                    save_slim(os.path.join(args.ckpt_dir, '%s_%s_%d_best.slim' % ('MRL', args.data_name, args.output_dim)), multi_models, C,
+                              args.slim_dtype, data_name=args.data_name, views=args.views[: n_view], epoch=epoch, **test_dict)
             return val_dict
 
+    def benchmark(steps):
+        # time the real training step and evaluation encode of this configuration, see autotune.py
+        train(0, 2)  # warm-up: loader workers, cudnn autotuning, allocator
+        torch.cuda.reset_peak_memory_stats()
+        start = time.time()
+        train(0, steps)
+        train_time = time.time() - start
+        set_eval()
+        encode(test_loader, 'test', cache=False)  # warm-up
+        start = time.time()
+        encode(test_loader, 'test', cache=False)  # the encode loop alone, without the cache and its weight hashing
+        eval_time = time.time() - start
+        summary_writer.close()
+        planner.close()
+        return {'train_samples_per_s': min(steps * args.train_batch_size, len(train_dataset)) / train_time,
+                'eval_samples_per_s': len(test_dataset) / eval_time, 'peak_memory_MB': torch.cuda.max_memory_allocated() / 2. ** 20}
+
+    if args.benchmark_steps > 0:
+        return benchmark(args.benchmark_steps)
+
+    def report(epoch, snapshot, result):
+        # a result of the background evaluation, possibly several epochs late: the snapshot holds its weights
+        nonlocal multi_model_state_dict, W_best
+        global best_acc
+        avg = {}
+        for mode in ['valid', 'test']:
+            MAPs, print_str = result[mode]['MAPs'], '%s (epoch %d): ' % (mode.capitalize(), epoch)
+            retrieval_dict = {}
+            for i in range(n_view):
+                for j in range(n_view):
+                    if i != j:
+                        retrieval_dict['%s2%s' % (args.views[i], args.views[j])] = MAPs[i, j]
+                        print_str = print_str + '%s2%s: %g\t' % (args.views[i], args.views[j], MAPs[i, j])
+            retrieval_dict['avg'] = avg[mode] = MAPs.sum() / n_view / (n_view - 1.)
+            print(print_str + 'Avg: %g' % avg[mode])
+            loss_dict = {('view_%d_loss' % v): result[mode]['loss'][v] for v in range(n_view)}
+            loss_dict['sum_loss'] = sum(result[mode]['loss'])
+            summary_writer.add_scalars('Loss/' + mode, loss_dict, epoch)
+            summary_writer.add_scalars('Accuracy/' + mode, {('view_%d_acc' % v): result[mode]['acc'][v] for v in range(n_view)}, epoch)
+            summary_writer.add_scalars('Retrieval/' + mode, retrieval_dict, epoch)
+        if avg['valid'] > best_acc:
+            best_acc = avg['valid']
+            print('Saving..')
+            state = {'model_state_dict_%d' % v: snapshot['state_dicts'][v] for v in range(n_view)}
+            state.update(retrieval_dict)
+            state['epoch'] = epoch
+            state['optimizer_state_dict'] = snapshot['optimizer_state_dict']
+            state['C'] = snapshot['C']
+            torch.save(state, os.path.join(args.ckpt_dir, '%s_%s_%d_best_checkpoint.t7' % ('MRL', args.data_name, args.output_dim)))
+            if args.slim_dtype:
+                snapshot_models = build_models(args, [train_dataset.train_data[v].shape[1] for v in range(n_view)])
+                for v in range(n_view):
+                    snapshot_models[v].load_state_dict(snapshot['state_dicts'][v])
+                save_slim(os.path.join(args.ckpt_dir, '%s_%s_%d_best.slim' % ('MRL', args.data_name, args.output_dim)), snapshot_models,
+                          snapshot['C'], args.slim_dtype, data_name=args.data_name, views=args.views[: n_view], epoch=epoch, **retrieval_dict)
+            multi_model_state_dict = [{key: value.cuda() for (key, value) in sd.items()} for sd in snapshot['state_dicts']]
+            W_best = snapshot['C'].cuda()
+
     # test(1)
     best_prec1 = 0.
     lr_schedu.step(start_epoch)
     train(-1)
     results = test(-1)
+    multi_model_state_dict = [{key: value.clone() for (key, value) in m.state_dict().items()} for m in multi_models]
+    W_best = C.clone()
+    evaluator = None
+    if args.async_eval:
+        evaluator = AsyncEvaluator(args, [train_dataset.train_data[v].shape[1] for v in range(n_view)], train_dataset.class_num,
+                                   {mode: (d.train_data, d.noise_label) for mode, d in [('valid', valid_dataset), ('test', test_dataset)]},
+                                   args.async_eval_device, args.async_eval_pending)
     for epoch in range(start_epoch, args.max_epochs):
+        if selector is not None and epoch >= args.select_warmup and (epoch - args.select_warmup) % args.select_interval == 0:
+            select(epoch)
         train(epoch)
         lr_schedu.step(epoch)
+        if evaluator is not None:
+            # training goes on while the background process encodes and scores this snapshot
+            for result in evaluator.submit(epoch + 1, multi_models, C, optimizer_state_dict=optimizer.state_dict()):
+                report(*result)
+            continue
         test_dict = test(epoch + 1)
         if test_dict['avg'] == best_acc:
             multi_model_state_dict = [{key: value.clone() for (key, value) in m.state_dict().items()} for m in multi_models]
             W_best = C.clone()
+    if evaluator is not None:
+        for result in evaluator.poll(0):
+            report(*result)
+        evaluator.close()
 
     print('Evaluation on Last Epoch:')
     fea, lab = eval(test_loader, epoch, 'test')
@@ -337,65 +537,29 @@ def main():
 
     print('Evaluation on Best Validation:')
     [multi_models[v].load_state_dict(multi_model_state_dict[v]) for v in range(n_view)]
+    fingerprints.clear()  # the weights were replaced outside an optimizer step
     fea, lab = eval(test_loader, epoch, 'test')
     test_dict, print_str = multiview_test(fea, lab)
     print(print_str)
-    import scipy.io as sio
-    save_dict = dict(**{args.views[v]: fea[v] for v in range(n_view)}, **{args.views[v] + '_lab': lab[v] for v in range(n_view)})
-    save_dict['C'] = W_best.detach().cpu().numpy()
-    sio.savemat('features/%s_%g.mat' % (args.data_name, args.noisy_ratio), save_dict)
-
-def fx_calc_map_multilabel_k(train, train_labels, test, test_label, k=0, metric='cosine'):
-    dist = scipy.spatial.distance.cdist(test, train, metric)
-    ord = dist.argsort()
-    numcases = dist.shape[0]
-    if k == 0:
-        k = numcases
-    res = []
-    for i in range(numcases):
-        order = ord[i].reshape(-1)
-
-        tmp_label = (np.dot(train_labels[order], test_label[i]) > 0)
-        if tmp_label.sum() > 0:
-            prec = tmp_label.cumsum() / np.arange(1.0, 1 + tmp_label.shape[0])
-            total_pos = float(tmp_label.sum())
-            if total_pos > 0:
-                res += [np.dot(tmp_label, prec) / total_pos]
-    return np.mean(res)
-
-def fx_calc_map_label(train, train_labels, test, test_label, k=0, metric='cosine'):
-    dist = scipy.spatial.distance.cdist(test, train, metric)
-
-    ord = dist.argsort(1)
-
-    numcases = train_labels.shape[0]
-    if k == 0:
-        k = numcases
-    if k == -1:
-        ks = [50, numcases]
+    export_path = os.path.join('features', args.export_name or '%s_%g' % (args.data_name, args.noisy_ratio))
+    if args.export_format == 'mat':
+        import scipy.io as sio
+        save_dict = dict(**{args.views[v]: fea[v] for v in range(n_view)}, **{args.views[v] + '_lab': lab[v] for v in range(n_view)})
+        save_dict['C'] = W_best.detach().cpu().numpy()
+        sio.savemat(export_path + '.mat', save_dict)
     else:
-        ks = [k]
-
-    def calMAP(_k):
-        _res = []
-        for i in range(len(test_label)):
-            order = ord[i]
-            p = 0.0
-            r = 0.0
-            for j in range(_k):
-                if test_label[i] == train_labels[order[j]]:
-                    r += 1
-                    p += (r / (j + 1))
-            if r > 0:
-                _res += [p / r]
-            else:
-                _res += [0]
-        return np.mean(_res)
-
-    res = []
-    for k in ks:
-        res.append(calMAP(k))
-    return res
+        writer = FeatureWriter(export_path, fmt=args.export_format,
+                               dtype='float16' if args.export_fp16 else 'float32')
+        if not args.streaming:
+            train_dataset.reset(None, None)  # export the full training set, not the last selection
+        loaders = {'train': train_loader, 'valid': valid_loader, 'test': test_loader}
+        for mode in args.export_splits:
+            export(writer, loaders[mode], mode)
+        writer.save('C', W_best.detach().cpu().numpy())
+        writer.close(data_name=args.data_name, noisy_ratio=args.noisy_ratio, views=args.views[: n_view], output_dim=args.output_dim)
+    summary_writer.close()
+    planner.close()
+    return test_dict
 
 if __name__ == '__main__':
     main()
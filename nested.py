@@ -0,0 +1,71 @@
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from main_noisy import load_models
+from src.compress import encode
+from src.metrics import average_precision, shortlist_distance
+from src.noisydataset import cross_modal_dataset
+from src.report import append_report, split_args
+from utils.config import get_config
+
+# MAP against retrieval cost of the embedding prefixes of a checkpoint trained with --nested_dims, on the test
+# split: each prefix alone, and as the shortlist stage of a coarse-to-fine search re-ranked at full dimension.
+# The cost is the number of multiply-adds per query and the measured search time over all view pairs.
+#
+# python nested.py --checkpoint ckpt/noisylabel/MRL_wiki_512_best_checkpoint.t7 --shortlist 100 \
+#     -- --data_name wiki --noisy_ratio 0.6 --nested_dims 64 128 256
+parser = argparse.ArgumentParser(description='MRL nested embedding retrieval')
+parser.add_argument('--checkpoint', type=str, required=True)
+parser.add_argument('--dims', type=int, nargs='*', default=[], help='prefix sizes, --nested_dims and --output_dim by default')
+parser.add_argument('--shortlist', type=int, nargs='+', default=[100], help='items re-ranked at full dimension')
+parser.add_argument('--report', type=str, default='nested_report.csv')
+
+
+def search(fea, lab, dim, shortlist):
+    """Average cross-view MAP of a search and its time in seconds."""
+    n_view = len(fea)
+    maps, elapsed = [], 0.
+    for i in range(n_view):
+        for j in range(n_view):
+            if i == j:
+                continue
+            start = time.time()
+            dist = shortlist_distance(fea[i], fea[j], dim, shortlist)
+            elapsed += time.time() - start
+            maps.append(average_precision(dist, lab[i], lab[j]).mean())
+    return np.mean(maps), elapsed
+
+
+def main():
+    nested_args, config_argv = split_args(parser)
+    config = get_config(config_argv)
+    if config.threads > 0:
+        torch.set_num_threads(config.threads)
+
+    test_dataset = cross_modal_dataset(config.data_name, config.noisy_ratio, 'test', storage=config.storage_dtype)
+    n_view = len(test_dataset.train_data)
+    input_dims = [test_dataset.train_data[v].shape[1] for v in range(n_view)]
+    multi_models, _ = load_models(config, nested_args.checkpoint, input_dims)
+    fea = [encode(multi_models[v], test_dataset.train_data[v], config.eval_batch_size)[0] for v in range(n_view)]
+    lab = [np.asarray(test_dataset.noise_label[v]).astype('int64') for v in range(n_view)]
+    full_dim, gallery = fea[0].shape[1], fea[0].shape[0]
+
+    rows = []
+    dims = sorted(set(nested_args.dims or config.nested_dims + [full_dim]))
+    for dim in dims:
+        for shortlist in [0] + ([] if dim >= full_dim else nested_args.shortlist):
+            MAP, elapsed = search(fea, lab, dim, shortlist)
+            rows.append({'data_name': config.data_name, 'dim': dim, 'shortlist': shortlist,
+                         'madds_per_query': gallery * dim + min(shortlist, gallery) * full_dim,
+                         'search_s': elapsed, 'MAP': MAP})
+            print('dim %4d | shortlist %5d | %10d madds/query | %8.3f s | MAP %.4f' % (
+                dim, shortlist, rows[-1]['madds_per_query'], elapsed, MAP))
+
+    append_report(nested_args.report, rows)
+
+
+if __name__ == '__main__':
+    main()
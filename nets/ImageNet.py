@@ -4,20 +4,21 @@ from torch.nn import functional as F
 
 
 class ImageNet(nn.Module):
-    def __init__(self, input_dim, output_dim):
+    def __init__(self, input_dim, output_dim, mid_num=4096):
         """
         :param input_dim: dimension of tags
         :param output_dim: dimensionality of the final representation
+        :param mid_num: width of the hidden layers, or a pair of widths for fc1 and fc2
         """
         super(ImageNet, self).__init__()
         self.module_name = "image_model"
 
         # full-conv layers
-        mid_num = 4096
-        self.fc1 = nn.Linear(input_dim, mid_num)
-        self.fc2 = nn.Linear(mid_num, mid_num)
+        mid1, mid2 = (mid_num, mid_num) if isinstance(mid_num, int) else mid_num
+        self.fc1 = nn.Linear(input_dim, mid1)
+        self.fc2 = nn.Linear(mid1, mid2)
         # self.fc2_2 = nn.Linear(mid_num, mid_num)
-        self.fc3 = nn.Linear(mid_num, output_dim)
+        self.fc3 = nn.Linear(mid2, output_dim)
 
     def forward(self, x):
         x = F.relu(self.fc1(x))
@@ -4,22 +4,27 @@ from torch.nn import functional as F
 
 
 class TextNet(nn.Module):
-    def __init__(self, input_dim, output_dim):
+    def __init__(self, input_dim, output_dim, mid_num=4096):
         """
         :param input_dim: dimension of tags
         :param output_dim: dimensionality of the final representation
+        :param mid_num: width of the hidden layers, or a pair of widths for fc1 and fc2
         """
         super(TextNet, self).__init__()
         self.module_name = "text_model"
 
         # full-conv layers
-        mid_num = 4096
-        self.fc1 = nn.Linear(input_dim, mid_num)
-        self.fc2 = nn.Linear(mid_num, mid_num)
-        self.fc3 = nn.Linear(mid_num, output_dim)
+        mid1, mid2 = (mid_num, mid_num) if isinstance(mid_num, int) else mid_num
+        self.fc1 = nn.Linear(input_dim, mid1)
+        self.fc2 = nn.Linear(mid1, mid2)
+        self.fc3 = nn.Linear(mid2, output_dim)
 
     def forward(self, x):
-        x = F.relu(self.fc1(x))
+        if x.is_sparse:
+            # bag-of-words input: the cost of fc1 scales with the non-zeros, not the vocabulary
+            x = F.relu(torch.sparse.mm(x, self.fc1.weight.t()) + self.fc1.bias)
+        else:
+            x = F.relu(self.fc1(x))
         x = F.relu(self.fc2(x))
         x = self.fc3(x)
         norm = torch.norm(x, dim=1, keepdim=True)
@@ -0,0 +1,68 @@
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from main_noisy import load_models
+from src.compress import encode
+from src.noisydataset import cross_modal_dataset
+from src.partition import ClassPartitionIndex, partition_map
+from src.report import append_report, split_args
+from utils.config import get_config
+
+# Class-partitioned retrieval on the test split: the gallery of every view is partitioned by the classes predicted
+# with the prototypes C of the checkpoint, and each query only probes the partitions of its top-m classes (a full
+# scan below --min_confidence). Reports the search latency, the fraction of the gallery scanned and the MAP
+# against m, next to the full scan.
+#
+# python partition.py --checkpoint ckpt/noisylabel/MRL_wiki_512_best_checkpoint.t7 --probes 1 2 3 \
+#     -- --data_name wiki --noisy_ratio 0.6 --loss MCE --tau 1
+parser = argparse.ArgumentParser(description='MRL class-partitioned search')
+parser.add_argument('--checkpoint', type=str, required=True)
+parser.add_argument('--probes', type=int, nargs='+', default=[1, 2, 3], help='numbers m of probed classes')
+parser.add_argument('--assign', type=int, default=1, help='partitions each gallery item is put in')
+parser.add_argument('--min_confidence', type=float, default=0., help='full scan for queries whose top-1 probability is lower')
+parser.add_argument('--report', type=str, default='partition_report.csv')
+
+
+def main():
+    partition_args, config_argv = split_args(parser)
+    config = get_config(config_argv)
+    if config.threads > 0:
+        torch.set_num_threads(config.threads)
+
+    test_dataset = cross_modal_dataset(config.data_name, config.noisy_ratio, 'test', storage=config.storage_dtype)
+    n_view = len(test_dataset.train_data)
+    input_dims = [test_dataset.train_data[v].shape[1] for v in range(n_view)]
+    multi_models, C = load_models(config, partition_args.checkpoint, input_dims)
+    C = C.numpy()
+    fea = [encode(multi_models[v], test_dataset.train_data[v], config.eval_batch_size)[0] for v in range(n_view)]
+    lab = [np.asarray(test_dataset.noise_label[v]).astype('int64') for v in range(n_view)]
+    indexes = [ClassPartitionIndex(fea[v], C, partition_args.assign, config.tau) for v in range(n_view)]
+
+    rows = []
+    # m = number of classes probes every partition, the full scan
+    for m in sorted(set(partition_args.probes)) + [C.shape[1]]:
+        maps, elapsed, scanned, total = [], 0., 0, 0
+        for i in range(n_view):
+            for j in range(n_view):
+                if i == j:
+                    continue
+                start = time.time()
+                results, num = indexes[j].search(fea[i], m, partition_args.min_confidence)
+                elapsed += time.time() - start
+                maps.append(partition_map(results, lab[i], lab[j]))
+                scanned += num
+                total += fea[i].shape[0] * fea[j].shape[0]
+        num_queries = sum(f.shape[0] for f in fea) * (n_view - 1)
+        rows.append({'data_name': config.data_name, 'm': m, 'assign': partition_args.assign,
+                     'min_confidence': partition_args.min_confidence, 'scanned': scanned / float(total),
+                     'ms_per_query': 1000. * elapsed / num_queries, 'MAP': np.mean(maps)})
+        print('m %3d | scanned %5.1f%% | %8.4f ms/query | MAP %.4f' % (m, 100. * rows[-1]['scanned'], rows[-1]['ms_per_query'], rows[-1]['MAP']))
+
+    append_report(partition_args.report, rows)
+
+
+if __name__ == '__main__':
+    main()
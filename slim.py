@@ -0,0 +1,39 @@
+import argparse
+import os
+import time
+
+import torch
+
+from main_noisy import load_models
+from src.report import split_args
+from src.slim import load_slim, save_slim
+from utils.config import get_config
+
+# Convert a training checkpoint (model_state_dict_%d, C, optimizer state) to an inference-only .slim artifact,
+# the per-view encoders and C in one flat aligned file with a JSON header, loaded zero-copy by src.slim.load_slim.
+#
+# python slim.py --checkpoint ckpt/noisylabel/MRL_wiki_512_best_checkpoint.t7 --fp16 -- --data_name wiki
+parser = argparse.ArgumentParser(description='MRL slim inference checkpoint')
+parser.add_argument('--checkpoint', type=str, required=True)
+parser.add_argument('--fp16', action='store_true', help='store the weights as float16')
+parser.add_argument('--output', type=str, default='', help='the checkpoint path with a .slim extension by default')
+
+
+def main():
+    slim_args, config_argv = split_args(parser)
+    config = get_config(config_argv)
+    ckpt = torch.load(slim_args.checkpoint, map_location='cpu')
+    input_dims = [ckpt['model_state_dict_%d' % v]['fc1.weight'].shape[1] for v in range(sum(k.startswith('model_state_dict_') for k in ckpt))]
+    multi_models, C = load_models(config, slim_args.checkpoint, input_dims)
+    output = slim_args.output or os.path.splitext(slim_args.checkpoint)[0] + '.slim'
+    save_slim(output, multi_models, C, 'float16' if slim_args.fp16 else 'float32', data_name=config.data_name,
+              views=config.views[: len(multi_models)])
+
+    start = time.time()
+    load_slim(output)
+    print('%s: %.2f MB -> %s: %.2f MB, loaded in %.1f ms' % (slim_args.checkpoint, os.path.getsize(slim_args.checkpoint) / 2. ** 20, output,
+                                                           os.path.getsize(output) / 2. ** 20, 1000. * (time.time() - start)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+import queue
+import traceback
+
+import numpy as np
+import torch
+
+
+def _to_cpu(obj):
+    """Host-memory copy of the tensors of a (nested) state dict."""
+    if torch.is_tensor(obj):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return {k: _to_cpu(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_to_cpu(v) for v in obj)
+    return obj
+
+
+def _worker(config, input_dims, class_num, splits, device, tasks, results):
+    from main_noisy import build_models
+    import src.utils as utils
+    from src.compress import hidden_widths
+    from src.metrics import EvalPlanner
+    from src.sparse import to_tensor
+
+    if config.threads > 0:
+        torch.set_num_threads(config.threads)
+    if config.loss == 'CE':
+        criterion = torch.nn.CrossEntropyLoss()
+    else:
+        criterion = utils.MeanClusteringError(class_num, tau=config.tau)
+    criterion = criterion.to(device)
+    planner = EvalPlanner()  # keeps the relevance of the valid and test labels across epochs
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        epoch, state_dicts, C = task
+        try:
+            multi_models = build_models(config, input_dims, [hidden_widths(sd) for sd in state_dicts])
+            C = C.to(device)
+            for v, model in enumerate(multi_models):
+                model.load_state_dict(state_dicts[v])
+                model.to(device).eval()
+            result = {}
+            with torch.no_grad():
+                for mode, (train_data, noise_label) in splits.items():
+                    fea, loss, acc = [], [], []
+                    for v, model in enumerate(multi_models):
+                        outputs = torch.cat([model(to_tensor(train_data[v][ct: ct + config.eval_batch_size]).to(device))
+                                             for ct in range(0, train_data[v].shape[0], config.eval_batch_size)])
+                        targets = torch.from_numpy(np.asarray(noise_label[v]).astype('int64')).to(device)
+                        pred = outputs.mm(C)
+                        loss.append(criterion(pred, targets).item())
+                        acc.append(pred.argmax(1).eq(targets).float().mean().item())
+                        fea.append(outputs.cpu().numpy())
+                    lab = [np.asarray(noise_label[v]).astype('int64') for v in range(len(fea))]
+                    result[mode] = {'MAPs': planner(fea, lab), 'loss': loss, 'acc': acc}
+            results.put((epoch, result))
+        except Exception:
+            results.put((epoch, traceback.format_exc()))
+
+
+class AsyncEvaluator(object):
+    """
+    Encode the valid and test splits and compute their retrieval MAPs in a separate process while training goes on.
+    submit() hands over a host-memory snapshot of the encoders and C; poll() returns the finished evaluations in
+    submission order together with their snapshot, so that a late result still saves the weights it was computed on.
+    """
+
+    def __init__(self, config, input_dims, class_num, splits, device='cpu', max_pending=2):
+        """
+        :param splits: {mode: (per-view features, per-view labels)} to evaluate, e.g. valid and test
+        :param max_pending: evaluations in flight before submit() waits for the oldest one
+        """
+        import multiprocessing as mp
+        ctx = mp.get_context('spawn')
+        self.tasks, self.results = ctx.Queue(), ctx.Queue()
+        self.process = ctx.Process(target=_worker, args=(config, input_dims, class_num, splits, device, self.tasks, self.results), daemon=True)
+        self.process.start()
+        self.max_pending = max_pending
+        self.pending = {}
+
+    def submit(self, epoch, multi_models, C, **extra):
+        """
+        :param extra: more state kept with the snapshot, e.g. optimizer_state_dict for the checkpoint
+        """
+        finished = self.poll(self.max_pending - 1)
+        snapshot = {'state_dicts': [_to_cpu(m.state_dict()) for m in multi_models], 'C': _to_cpu(C)}
+        snapshot.update(_to_cpu(extra))
+        self.pending[epoch] = snapshot
+        self.tasks.put((epoch, snapshot['state_dicts'], snapshot['C']))
+        return finished
+
+    def poll(self, max_pending=None):
+        """
+        Collect the finished evaluations as (epoch, snapshot, result), waiting until at most max_pending
+        are in flight (None: do not wait).
+        """
+        finished = []
+        while self.pending:
+            wait = max_pending is not None and len(self.pending) > max_pending
+            try:
+                epoch, result = self.results.get(block=wait)
+            except queue.Empty:
+                break
+            if isinstance(result, str):
+                raise Exception('Evaluation of epoch %d failed:\n%s' % (epoch, result))
+            finished.append((epoch, self.pending.pop(epoch), result))
+        return finished
+
+    def close(self):
+        self.tasks.put(None)
+        self.process.join()
@@ -0,0 +1,69 @@
+import hashlib
+import os
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+
+def fingerprint(state_dict):
+    """
+    Hash the names, shapes, dtypes and values of a state dict.
+    """
+    h = hashlib.sha1()
+    for key, value in state_dict.items():
+        value = value.detach().cpu().contiguous()
+        h.update(('%s%s%s' % (key, tuple(value.shape), value.dtype)).encode())
+        if value.dtype == torch.bfloat16:
+            value = value.float()
+        h.update(value.numpy().reshape(-1))
+    return h.hexdigest()
+
+
+def split_key(data_name, mode, labels):
+    """
+    Identify a split by its name and its (possibly re-selected or re-labelled) labels.
+    """
+    h = hashlib.sha1()
+    for lab in labels:
+        h.update(np.ascontiguousarray(lab).reshape(-1))
+    return '%s_%s_%s' % (data_name, mode, h.hexdigest()[:16])
+
+
+class EmbeddingCache(object):
+    """
+    LRU cache of encoded splits, optionally persisted to cache_dir.
+    """
+
+    def __init__(self, capacity=12, cache_dir=''):
+        self.capacity = capacity
+        self.cache_dir = cache_dir
+        self.entries = OrderedDict()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, hashlib.sha1(repr(key).encode()).hexdigest() + '.npy')
+
+    def get(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        if self.cache_dir and os.path.exists(self._path(key)):
+            value = np.load(self._path(key))
+            self._insert(key, value)
+            return value
+        return None
+
+    def put(self, key, value):
+        self._insert(key, value)
+        if self.cache_dir:
+            np.save(self._path(key), value)
+
+    def _insert(self, key, value):
+        if self.capacity <= 0:
+            return
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
@@ -0,0 +1,81 @@
+import copy
+import io
+import time
+
+import numpy as np
+import torch
+from torch import nn
+
+from .sparse import to_tensor
+
+
+def hidden_widths(state_dict):
+    """Widths of fc1 and fc2 of an ImageNet/TextNet state dict, e.g. of a pruned checkpoint."""
+    return state_dict['fc1.weight'].shape[0], state_dict['fc2.weight'].shape[0]
+
+
+def _slice_linear(layer, rows=None, cols=None):
+    weight, bias = layer.weight.data, layer.bias.data
+    if rows is not None:
+        weight, bias = weight[rows], bias[rows]
+    if cols is not None:
+        weight = weight[:, cols]
+    new = nn.Linear(weight.shape[1], weight.shape[0]).to(weight.device)
+    new.weight.data.copy_(weight)
+    new.bias.data.copy_(bias)
+    return new
+
+
+def prune_hidden_units(model, ratio):
+    """
+    Structured magnitude pruning of an ImageNet/TextNet: remove the given ratio of the hidden units of
+    fc1 and fc2 with the smallest product of incoming and outgoing weight norms.
+    """
+    def keep(score):
+        num = max(1, int(round(score.shape[0] * (1. - ratio))))
+        return score.topk(num).indices.sort().values
+
+    with torch.no_grad():
+        keep1 = keep(model.fc1.weight.norm(dim=1) * model.fc2.weight.norm(dim=0))
+        keep2 = keep(model.fc2.weight.norm(dim=1) * model.fc3.weight.norm(dim=0))
+        model.fc1 = _slice_linear(model.fc1, rows=keep1)
+        model.fc2 = _slice_linear(model.fc2, rows=keep2, cols=keep1)
+        model.fc3 = _slice_linear(model.fc3, cols=keep2)
+    return model
+
+
+def quantize(model):
+    """Post-training dynamic int8 quantization of the nn.Linear layers, for CPU inference."""
+    return torch.quantization.quantize_dynamic(copy.deepcopy(model).cpu().eval(), {nn.Linear}, dtype=torch.qint8)
+
+
+def model_size(model):
+    """Serialized size of the state dict in bytes."""
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell()
+
+
+def encode(model, data, batch_size=200):
+    """Encode a feature matrix on the CPU, return the embeddings and the throughput in samples/s."""
+    model.eval()
+    outputs = []
+    start = time.time()
+    with torch.no_grad():
+        for ct in range(0, data.shape[0], batch_size):
+            outputs.append(model(to_tensor(data[ct: ct + batch_size])))
+    elapsed = time.time() - start
+    return torch.cat(outputs).numpy(), data.shape[0] / max(elapsed, 1e-9)
+
+
+def evaluate(multi_models, test_dataset, planner, batch_size=200):
+    """Average cross-view MAP of CPU encoders on a split, and the throughput of the slowest view."""
+    n_view = len(multi_models)
+    fea, speed = [], []
+    for v in range(n_view):
+        f, s = encode(multi_models[v], test_dataset.train_data[v], batch_size)
+        fea.append(f)
+        speed.append(s)
+    lab = [np.asarray(test_dataset.noise_label[v]).astype('int64') for v in range(n_view)]
+    MAPs = planner(fea, lab)
+    return MAPs.sum() / n_view / (n_view - 1.), min(speed)
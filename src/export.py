@@ -0,0 +1,75 @@
+import json
+import os
+
+import numpy as np
+
+
+class FeatureWriter(object):
+    """
+    Stream arrays batch by batch into memory-mappable .npy files (one per array, in directory path)
+    or into a chunked, compressed HDF5 file (path + '.h5'). A JSON sidecar describes every array.
+
+    writer = FeatureWriter('features/wiki_0.6', fmt='npy', dtype='float16')
+    writer.create('test/Img', (n, 512))
+    writer.write('test/Img', 0, batch)
+    writer.close(data_name='wiki')
+    """
+
+    def __init__(self, path, fmt='npy', dtype='float32', chunk_rows=1024, compression='gzip'):
+        self.path = path
+        self.fmt = fmt
+        self.dtype = np.dtype(dtype)
+        self.chunk_rows = chunk_rows
+        self.arrays = {}
+        self.meta = {}
+        if fmt == 'npy':
+            os.makedirs(path, exist_ok=True)
+        elif fmt == 'h5':
+            import h5py
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            self.file = h5py.File(path + '.h5', 'w')
+            self.compression = compression
+        else:
+            raise Exception('No such export format.')
+
+    def create(self, name, shape, dtype=None):
+        dtype = self.dtype if dtype is None else np.dtype(dtype)
+        if self.fmt == 'npy':
+            filename = name.replace('/', '_') + '.npy'
+            self.arrays[name] = np.lib.format.open_memmap(os.path.join(self.path, filename), mode='w+', dtype=dtype, shape=tuple(shape))
+        else:
+            filename = os.path.basename(self.path) + '.h5'
+            chunks = (min(self.chunk_rows, shape[0]),) + tuple(shape[1:]) if shape[0] > 0 else None
+            self.arrays[name] = self.file.create_dataset(name, shape=tuple(shape), dtype=dtype, chunks=chunks, compression=self.compression)
+        self.meta[name] = {'file': filename, 'shape': list(shape), 'dtype': dtype.name}
+
+    def write(self, name, start, array):
+        self.arrays[name][start: start + array.shape[0]] = array.astype(self.arrays[name].dtype, copy=False)
+
+    def save(self, name, array, dtype=None):
+        self.create(name, array.shape, array.dtype if dtype is None else dtype)
+        self.write(name, 0, array)
+
+    def close(self, **info):
+        for array in self.arrays.values():
+            if self.fmt == 'npy':
+                array.flush()
+        if self.fmt == 'h5':
+            self.file.close()
+        sidecar = os.path.join(self.path, 'meta.json') if self.fmt == 'npy' else self.path + '.json'
+        info['format'] = self.fmt
+        info['arrays'] = self.meta
+        with open(sidecar, 'w') as f:
+            json.dump(info, f, indent=2)
+
+
+def open_features(path, name, mmap_mode='r'):
+    """
+    Open an exported array without reading it: a read-only memmap for .npy and a lazy h5py dataset for HDF5.
+    """
+    if os.path.isdir(path):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        return np.load(os.path.join(path, meta['arrays'][name]['file']), mmap_mode=mmap_mode)
+    import h5py
+    return h5py.File(path + '.h5', 'r')[name]
@@ -0,0 +1,78 @@
+import os
+
+import numpy as np
+import torch.utils.data as data
+
+from .sparse import is_sparse, sparsify
+
+
+def load_pairs(path, views):
+    """
+    Read new paired samples saved as per-view arrays named after the views with their labels as '<view>_lab'
+    (the layout of the exported .mat features), from a .npz, .mat or HDF5 file.
+    :return: per-view features and per-view labels
+    """
+    ext = os.path.splitext(path)[1]
+    if ext == '.npz':
+        f = np.load(path)
+    elif ext == '.mat':
+        import scipy.io as sio
+        f = sio.loadmat(path)
+    else:
+        import h5py
+        f = h5py.File(path, 'r')
+    views = [v for v in views if v in f]
+    train_data = [np.asarray(f[v][()], dtype='float32') for v in views]
+    train_label = [np.asarray(f[v + '_lab'][()]).reshape([-1]).astype('int64') for v in views]
+    return train_data, train_label
+
+
+def class_balanced_indices(labels, size, seed=0):
+    """
+    Up to size indices drawn with the same quota for every class, the quota of the classes with
+    fewer samples going to the others.
+    """
+    rng = np.random.RandomState(seed)
+    labels = np.asarray(labels).reshape(-1)
+    pools = [rng.permutation(np.flatnonzero(labels == c)) for c in np.unique(labels)]
+    taken = [0] * len(pools)
+    size = min(size, labels.shape[0])
+    while sum(taken) < size:
+        open_pools = [k for k in range(len(pools)) if taken[k] < len(pools[k])]
+        quota = max(1, (size - sum(taken)) // len(open_pools))
+        for k in open_pools:
+            taken[k] = min(len(pools[k]), taken[k] + quota, taken[k] + size - sum(taken))
+    return np.sort(np.concatenate([pool[:n] for pool, n in zip(pools, taken)]).astype('int64'))
+
+
+def _concat(parts):
+    # e.g. dense new pairs with the sparse (--sparse_text) replay of a bag-of-words view
+    if any(is_sparse(p) for p in parts):
+        import scipy.sparse as sp
+        return sp.vstack([sparsify(p) for p in parts], format='csr')
+    return np.concatenate([np.asarray(p, dtype='float32') for p in parts])
+
+
+class PairedDataset(data.Dataset):
+    """
+    In-memory paired samples, yielding the ([view features], [view labels], index) samples of cross_modal_dataset.
+    """
+
+    def __init__(self, train_data, noise_label):
+        self.train_data = train_data
+        self.noise_label = [np.asarray(lab).astype('int64') for lab in noise_label]
+
+    @classmethod
+    def concat(cls, datasets):
+        n_view = len(datasets[0].train_data)
+        return cls([_concat([d.train_data[v] for d in datasets]) for v in range(n_view)],
+                   [np.concatenate([d.noise_label[v] for d in datasets]) for v in range(n_view)])
+
+    def subset(self, index):
+        return PairedDataset([d[index] for d in self.train_data], [lab[index] for lab in self.noise_label])
+
+    def __getitem__(self, index):
+        return [d[index] for d in self.train_data], [lab[index] for lab in self.noise_label], index
+
+    def __len__(self):
+        return self.train_data[0].shape[0]
@@ -9,7 +9,6 @@ import os
 import logging
 import time
 from datetime import timedelta
-import pandas as pd
 
 
 class LogFormatter:
@@ -74,6 +73,7 @@ class PD_Stats(object):
     """
 
     def __init__(self, path, columns):
+        import pandas as pd
         self.path = path
 
         # reload path stats
@@ -0,0 +1,45 @@
+import torch
+from torch import nn
+
+
+class MemoryBank(nn.Module):
+    """
+    Per-view FIFO queue of past embeddings, stored in a preallocated ring buffer,
+    serving as extra negatives of the multimodal contrastive loss.
+    """
+
+    def __init__(self, n_view, size, dim, staleness=0):
+        """
+        :param size: number of embeddings kept per view
+        :param staleness: drop entries enqueued more than this many steps ago (0: keep until overwritten)
+        """
+        super(MemoryBank, self).__init__()
+        self.size = size
+        self.staleness = staleness
+        self.register_buffer('features', torch.zeros(n_view, size, dim))
+        self.register_buffer('index', -torch.ones(n_view, size, dtype=torch.long))
+        self.register_buffer('step', -torch.ones(n_view, size, dtype=torch.long))
+        self.ptr = 0
+        self.num_steps = 0
+
+    def negatives(self):
+        """Return the valid entries of all views as (features, sample indices)."""
+        valid = self.index >= 0
+        if self.staleness > 0:
+            valid &= self.step >= self.num_steps - self.staleness
+        return self.features[valid], self.index[valid]
+
+    @torch.no_grad()
+    def enqueue(self, fea, index):
+        """
+        :param fea: list of per-view embeddings of the batch
+        :param index: sample indices of the batch, used to mask the positives
+        """
+        batch_size = min(index.shape[0], self.size)
+        slots = (self.ptr + torch.arange(batch_size, device=self.features.device)) % self.size
+        for v in range(len(fea)):
+            self.features[v, slots] = fea[v][-batch_size:].detach().to(self.features.dtype)
+            self.index[v, slots] = index[-batch_size:].to(self.index.device)
+            self.step[v, slots] = self.num_steps
+        self.ptr = (self.ptr + batch_size) % self.size
+        self.num_steps += 1
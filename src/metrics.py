@@ -0,0 +1,217 @@
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+
+def fx_calc_map_multilabel_k(train, train_labels, test, test_label, k=0, metric='cosine'):
+    import scipy.spatial
+    dist = scipy.spatial.distance.cdist(test, train, metric)
+    ord = dist.argsort()
+    numcases = dist.shape[0]
+    if k == 0:
+        k = numcases
+    res = []
+    for i in range(numcases):
+        order = ord[i].reshape(-1)
+
+        tmp_label = (np.dot(train_labels[order], test_label[i]) > 0)
+        if tmp_label.sum() > 0:
+            prec = tmp_label.cumsum() / np.arange(1.0, 1 + tmp_label.shape[0])
+            total_pos = float(tmp_label.sum())
+            if total_pos > 0:
+                res += [np.dot(tmp_label, prec) / total_pos]
+    return np.mean(res)
+
+def fx_calc_map_label(train, train_labels, test, test_label, k=0, metric='cosine'):
+    import scipy.spatial
+    dist = scipy.spatial.distance.cdist(test, train, metric)
+
+    ord = dist.argsort(1)
+
+    numcases = train_labels.shape[0]
+    if k == 0:
+        k = numcases
+    if k == -1:
+        ks = [50, numcases]
+    else:
+        ks = [k]
+
+    def calMAP(_k):
+        _res = []
+        for i in range(len(test_label)):
+            order = ord[i]
+            p = 0.0
+            r = 0.0
+            for j in range(_k):
+                if test_label[i] == train_labels[order[j]]:
+                    r += 1
+                    p += (r / (j + 1))
+            if r > 0:
+                _res += [p / r]
+            else:
+                _res += [0]
+        return np.mean(_res)
+
+    res = []
+    for k in ks:
+        res.append(calMAP(k))
+    return res
+
+
+def cosine_distance(test, train):
+    """Same as scipy.spatial.distance.cdist(test, train, 'cosine') through one matrix product."""
+    test, train = test.astype('float64'), train.astype('float64')
+    test /= np.linalg.norm(test, axis=1, keepdims=True)
+    train /= np.linalg.norm(train, axis=1, keepdims=True)
+    return 1. - test.dot(train.T)
+
+
+def shortlist_distance(test, train, dim, shortlist=0, chunk=256):
+    """
+    Cosine distances of a coarse-to-fine search: the gallery is ranked with the first dim coordinates
+    of the embeddings, then the top shortlist items of each query are re-ranked at full dimension
+    (0: no re-ranking). The shortlist ranks first, by full-dimension distance, the rest after it.
+    """
+    dist = cosine_distance(test[:, :dim], train[:, :dim])
+    if shortlist <= 0 or dim >= test.shape[1]:
+        return dist
+    shortlist = min(shortlist, train.shape[0])
+    test = (test / np.linalg.norm(test, axis=1, keepdims=True)).astype('float32')
+    train = (train / np.linalg.norm(train, axis=1, keepdims=True)).astype('float32')
+    dist += 2.  # beyond any cosine distance
+    for b in range(0, dist.shape[0], chunk):
+        top = np.argpartition(dist[b: b + chunk], shortlist - 1, axis=1)[:, :shortlist]
+        full = 1. - np.einsum('qd,qkd->qk', test[b: b + chunk], train[top])
+        np.put_along_axis(dist[b: b + chunk], top, full, axis=1)
+    return dist
+
+
+class RelevanceContext(object):
+    """
+    Relevance of a gallery to a set of queries, built once per split since the labels do not change
+    during a run: the gallery sorted by class (one contiguous posting list per class), the queries
+    grouped by class and the number of positives of every query.
+    """
+
+    def __init__(self, test_label, train_labels):
+        test_label, train_labels = np.asarray(test_label).reshape(-1), np.asarray(train_labels).reshape(-1)
+        self.num_queries, self.num_gallery = test_label.shape[0], train_labels.shape[0]
+        self.gallery_order = np.argsort(train_labels, kind='stable')
+        classes, starts = np.unique(train_labels[self.gallery_order], return_index=True)
+        ends = np.append(starts[1:], self.num_gallery)
+        self.postings = {c: (s, e) for c, s, e in zip(classes.tolist(), starts.tolist(), ends.tolist())}
+        query_order = np.argsort(test_label, kind='stable')
+        query_classes, query_starts = np.unique(test_label[query_order], return_index=True)
+        self.query_groups = [(c, rows) for c, rows in zip(query_classes.tolist(), np.split(query_order, query_starts[1:]))]
+        counts = {c: e - s for c, (s, e) in self.postings.items()}
+        self.num_positives = np.array([counts.get(c, 0) for c in test_label.tolist()])
+
+    def average_precision(self, dist, chunk=1024):
+        """
+        AP of every query (row of dist) over the full ranking of the gallery (columns), i.e. fx_calc_map_label
+        with k=0 before the mean. Only the positives of a query are sorted, each non-relevant item is
+        located among them by a binary search; ties between a relevant and a non-relevant item rank the relevant first.
+        """
+        res = np.zeros(self.num_queries)
+        for c, rows in self.query_groups:
+            n = self.num_positives[rows[0]]
+            if n == 0:  # no positive in the gallery: AP 0, nothing to slice
+                continue
+            s, e = self.postings[c]
+            pos_cols, neg_cols = self.gallery_order[s: e], np.concatenate((self.gallery_order[:s], self.gallery_order[e:]))
+            for b in range(0, len(rows), max(1, chunk)):
+                r = rows[b: b + chunk]
+                block = np.asarray(dist[r], dtype='float64')
+                d_pos, d_neg = np.sort(block[:, pos_cols], 1), block[:, neg_cols]
+                # one binary search for the whole chunk on (row, distance) keys: complex numbers sort
+                # lexicographically, so the rows never mix and the distances are not rounded
+                row = np.arange(len(r))[:, None]
+                slot = np.searchsorted((row + 1j * d_pos).ravel(), (row + 1j * d_neg).ravel(), side='right')
+                slot = slot.reshape(d_neg.shape) - row * n  # positives closer than or as close as each negative
+                codes = (row * (n + 1) + slot).ravel()
+                neg_before = np.bincount(codes, minlength=len(r) * (n + 1)).reshape(len(r), n + 1).cumsum(1)[:, :n]
+                k = np.arange(1., n + 1)
+                res[r] = (k / (k + neg_before)).mean(1)
+        return res
+
+
+def average_precision(dist, test_label, train_labels, chunk=1024, context=None):
+    """
+    AP of every query (row of dist) over the full ranking of the gallery (columns),
+    i.e. fx_calc_map_label with k=0 before the mean.
+    """
+    if context is None:
+        context = RelevanceContext(test_label, train_labels)
+    return context.average_precision(dist, chunk)
+
+
+def pair_map(fea_i, lab_i, fea_j, lab_j, symmetric=False, contexts=(None, None)):
+    """
+    MAP of i->j and j->i from a single distance matrix, the second ranking the columns of the first.
+    :param contexts: RelevanceContext of i->j and j->i, built here if None
+    """
+    dist = cosine_distance(fea_i, fea_j)
+    map_ij = average_precision(dist, lab_i, lab_j, context=contexts[0]).mean()
+    if symmetric:
+        return map_ij, map_ij
+    return map_ij, average_precision(dist.T, lab_j, lab_i, context=contexts[1]).mean()
+
+
+def _label_key(labels):
+    labels = np.ascontiguousarray(labels)
+    return hashlib.sha1(labels.view('uint8')).hexdigest(), labels.shape, labels.dtype.str
+
+
+class EvalPlanner(object):
+    """
+    Evaluate all view pairs of a split, computing each unordered pair once and
+    optionally spreading the pairs over a process pool. The RelevanceContext of the
+    max_contexts most recent pairs of label sets is kept, so that each epoch only ranks the new
+    embeddings, while the contexts of past selections of the training set are dropped.
+    """
+
+    def __init__(self, processes=0, max_contexts=128):
+        self.processes = processes
+        self.pool = None
+        self.max_contexts = max_contexts
+        self.contexts = OrderedDict()
+
+    def context(self, test_label, train_labels):
+        key = (_label_key(test_label), _label_key(train_labels))
+        if key in self.contexts:
+            self.contexts.move_to_end(key)
+            return self.contexts[key]
+        context = RelevanceContext(test_label, train_labels)
+        self.contexts[key] = context
+        while len(self.contexts) > self.max_contexts:
+            self.contexts.popitem(last=False)
+        return context
+
+    def pair_contexts(self, lab_i, lab_j, symmetric):
+        ij = self.context(lab_i, lab_j)
+        return ij, ij if symmetric else self.context(lab_j, lab_i)
+
+    def __call__(self, fea, lab, include_self=False):
+        n_view = len(fea)
+        pairs = [(i, j) for i in range(n_view) for j in range(i if include_self else i + 1, n_view)]
+        if self.processes > 0 and len(pairs) > 1:
+            if self.pool is None:
+                import multiprocessing as mp
+                from concurrent.futures import ProcessPoolExecutor
+                self.pool = ProcessPoolExecutor(self.processes, mp_context=mp.get_context('spawn'))
+            futures = [self.pool.submit(pair_map, fea[i], lab[i], fea[j], lab[j], i == j, self.pair_contexts(lab[i], lab[j], i == j))
+                       for i, j in pairs]
+            results = [f.result() for f in futures]
+        else:
+            results = [pair_map(fea[i], lab[i], fea[j], lab[j], i == j, self.pair_contexts(lab[i], lab[j], i == j)) for i, j in pairs]
+
+        MAPs = np.zeros([n_view, n_view])
+        for (i, j), (map_ij, map_ji) in zip(pairs, results):
+            MAPs[i, j], MAPs[j, i] = map_ij, map_ji
+        return MAPs
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
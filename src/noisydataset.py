@@ -7,127 +7,243 @@
 import random
 from logging import getLogger
 
-import cv2
-from PIL import ImageFilter, Image
 import numpy as np
-import torchvision.datasets as datasets
-import torchvision.transforms as transforms
 import torch.utils.data as data
-import scipy.io as sio
 import os
 import json
-from utils.config import args
-from numpy.testing import assert_array_almost_equal
-import h5py
 logger = getLogger()
 
-class cross_modal_dataset(data.Dataset):
-    def __init__(self, dataset, noisy_ratio, mode, noise_mode='sym', root_dir='data/', noise_file=None, pred=False, probability=[], log=''):
-        self.r = noisy_ratio # noise ratio
-        self.mode = mode
-        doc2vec = True
-        if 'wiki' in dataset.lower():
-            root_dir = os.path.join(root_dir, 'wiki')
-            path = os.path.join(root_dir, 'wiki_deep_doc2vec_data_corr_ae.h5py')  # wiki_deep_doc2vec_data
-            valid_len = 231
-        elif 'nus' in dataset.lower():
-            root_dir = os.path.join(root_dir, 'NUS-WIDE')
-            path = os.path.join(root_dir, 'nus_wide_deep_doc2vec_data_42941.h5py')
-            valid_len = 5000
-        elif 'inria' in dataset.lower():
-            root_dir = os.path.join(root_dir, 'INRIA-Websearch')
-            path = os.path.join(root_dir, 'INRIA-Websearch.mat')
-            doc2vec = False
-        elif 'xmedianet4view' in dataset.lower():
-            root_dir = os.path.join(root_dir, 'XMediaNet4View')
-            path = os.path.join(root_dir, 'XMediaNet4View_pairs.mat')
-            doc2vec = False
-        elif 'xmedianet2views' in dataset.lower():
-            root_dir = os.path.join(root_dir, 'XMediaNet')
-            path = os.path.join(root_dir, 'xmedianet_deep_doc2vec_data.h5py')
-            valid_len = 4000
-        else:
-            raise Exception('Have no such dataset!')
-
-        if doc2vec:
-            h = h5py.File(path)
-            if self.mode == 'test' or self.mode == 'valid':
-                test_imgs_deep = h['test_imgs_deep'][()].astype('float32')
-                test_imgs_labels = h['test_imgs_labels'][()]
-                test_imgs_labels -= np.min(test_imgs_labels)
-                try:
-                    test_texts_idx = h['test_text'][()].astype('float32')
-                except Exception as e:
-                    test_texts_idx = h['test_texts'][()].astype('float32')
-                test_texts_labels = h['test_texts_labels'][()]
-                test_texts_labels -= np.min(test_texts_labels)
-                test_data = [test_imgs_deep, test_texts_idx]
-                test_labels = [test_imgs_labels, test_texts_labels]
 
-                valid_flag = True
-                try:
-                    valid_texts_idx = h['valid_text'][()].astype('float32')
-                except Exception as e:
-                    try:
-                        valid_texts_idx = h['valid_texts'][()].astype('float32')
-                    except Exception as e:
-                        valid_flag = False
-                        valid_data = [test_data[0][0: valid_len], test_data[1][0: valid_len]]
-                        valid_labels = [test_labels[0][0: valid_len], test_labels[1][0: valid_len]]
-
-                        test_data = [test_data[0][valid_len::], test_data[1][valid_len::]]
-                        test_labels = [test_labels[0][valid_len::], test_labels[1][valid_len::]]
-                if valid_flag:
-                    valid_imgs_deep = h['valid_imgs_deep'][()].astype('float32')
-                    valid_imgs_labels = h['valid_imgs_labels'][()]
-                    valid_texts_labels = h['valid_texts_labels'][()]
-                    valid_texts_labels -= np.min(valid_texts_labels)
-                    valid_data = [valid_imgs_deep, valid_texts_idx]
-                    valid_labels = [valid_imgs_labels, valid_texts_labels]
-
-                train_data = valid_data if self.mode == 'valid' else test_data
-                train_label = valid_labels if self.mode == 'valid' else test_labels
-            elif self.mode == 'train':
-                tr_img = h['train_imgs_deep'][()].astype('float32')
-                tr_img_lab = h['train_imgs_labels'][()]
-                tr_img_lab -= np.min(tr_img_lab)
+class CompactArray(object):
+    """
+    Features stored as float16, bfloat16 (as int16 bits) or uint8 with a per-feature scale and offset.
+    Indexing upcasts only the gathered rows to float32.
+    """
+
+    def __init__(self, data, codec, scale=None, offset=None):
+        self.data = data
+        self.codec = codec
+        self.scale = scale
+        self.offset = offset
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        x = self.data[index]
+        if self.codec == 'float16':
+            return x.astype('float32')
+        elif self.codec == 'bfloat16':
+            return (x.view('uint16').astype('uint32') << 16).view('float32')
+        return x.astype('float32') * self.scale + self.offset
+
+    def subset(self, index):
+        """Select rows without upcasting them."""
+        return CompactArray(self.data[index], self.codec, self.scale, self.offset)
+
+
+def compact(x, storage='float32', chunk=4096):
+    """Convert a float feature matrix to its storage format, chunk by chunk."""
+    if storage == 'float32':
+        return x
+    elif storage == 'float16':
+        return CompactArray(x.astype('float16', copy=False), 'float16')
+    elif storage == 'bfloat16':
+        data = np.empty(x.shape, dtype='int16')
+        for b in range(0, x.shape[0], chunk):
+            # round to nearest even on the upper 16 bits
+            u = np.ascontiguousarray(x[b: b + chunk], dtype='float32').view('uint32')
+            u = u + 0x7FFF + ((u >> 16) & 1)
+            data[b: b + chunk] = (u >> 16).astype('uint16').view('int16')
+        return CompactArray(data, 'bfloat16')
+    elif storage == 'uint8':
+        offset = x.min(0).astype('float32')
+        scale = ((x.max(0) - offset) / 255.).astype('float32')
+        scale[scale == 0] = 1.
+        data = np.empty(x.shape, dtype='uint8')
+        for b in range(0, x.shape[0], chunk):
+            data[b: b + chunk] = np.rint((x[b: b + chunk] - offset) / scale)
+        return CompactArray(data, 'uint8', scale, offset)
+    raise Exception('No such storage dtype.')
+
+
+def dataset_path(dataset, root_dir='data/'):
+    valid_len = None
+    doc2vec = True
+    if 'wiki' in dataset.lower():
+        root_dir = os.path.join(root_dir, 'wiki')
+        path = os.path.join(root_dir, 'wiki_deep_doc2vec_data_corr_ae.h5py')  # wiki_deep_doc2vec_data
+        valid_len = 231
+    elif 'nus' in dataset.lower():
+        root_dir = os.path.join(root_dir, 'NUS-WIDE')
+        path = os.path.join(root_dir, 'nus_wide_deep_doc2vec_data_42941.h5py')
+        valid_len = 5000
+    elif 'inria' in dataset.lower():
+        root_dir = os.path.join(root_dir, 'INRIA-Websearch')
+        path = os.path.join(root_dir, 'INRIA-Websearch.mat')
+        doc2vec = False
+    elif 'xmedianet4view' in dataset.lower():
+        root_dir = os.path.join(root_dir, 'XMediaNet4View')
+        path = os.path.join(root_dir, 'XMediaNet4View_pairs.mat')
+        doc2vec = False
+    elif 'xmedianet2views' in dataset.lower():
+        root_dir = os.path.join(root_dir, 'XMediaNet')
+        path = os.path.join(root_dir, 'xmedianet_deep_doc2vec_data.h5py')
+        valid_len = 4000
+    else:
+        raise Exception('Have no such dataset!')
+    return root_dir, path, doc2vec, valid_len
+
+
+def load_features(dataset, mode, root_dir='data/', storage='float32', sparse=False):
+    """
+    Load the features and clean labels of one split as lists of per-view arrays.
+    :param storage: float32, or float16/bfloat16/uint8 to keep the features as CompactArray
+    :param sparse: keep the bag-of-words text view of the .mat datasets as a scipy CSR matrix
+    """
+    root_dir, path, doc2vec, valid_len = dataset_path(dataset, root_dir)
+    dtype = 'float16' if storage == 'float16' else 'float32'  # float16 is read from HDF5 without a float32 copy
+    if doc2vec:
+        import h5py
+        h = h5py.File(path)
+        if mode == 'test' or mode == 'valid':
+            test_imgs_deep = h['test_imgs_deep'].astype(dtype)[()]
+            test_imgs_labels = h['test_imgs_labels'][()]
+            test_imgs_labels -= np.min(test_imgs_labels)
+            try:
+                test_texts_idx = h['test_text'].astype(dtype)[()]
+            except Exception as e:
+                test_texts_idx = h['test_texts'].astype(dtype)[()]
+            test_texts_labels = h['test_texts_labels'][()]
+            test_texts_labels -= np.min(test_texts_labels)
+            test_data = [test_imgs_deep, test_texts_idx]
+            test_labels = [test_imgs_labels, test_texts_labels]
+
+            valid_flag = True
+            try:
+                valid_texts_idx = h['valid_text'].astype(dtype)[()]
+            except Exception as e:
                 try:
-                    tr_txt = h['train_text'][()].astype('float32')
+                    valid_texts_idx = h['valid_texts'].astype(dtype)[()]
                 except Exception as e:
-                    tr_txt = h['train_texts'][()].astype('float32')
-                tr_txt_lab = h['train_texts_labels'][()]
-                tr_txt_lab -= np.min(tr_txt_lab)
-                train_data = [tr_img, tr_txt]
-                train_label = [tr_img_lab, tr_txt_lab]
+                    valid_flag = False
+                    valid_data = [test_data[0][0: valid_len], test_data[1][0: valid_len]]
+                    valid_labels = [test_labels[0][0: valid_len], test_labels[1][0: valid_len]]
+
+                    test_data = [test_data[0][valid_len::], test_data[1][valid_len::]]
+                    test_labels = [test_labels[0][valid_len::], test_labels[1][valid_len::]]
+            if valid_flag:
+                valid_imgs_deep = h['valid_imgs_deep'].astype(dtype)[()]
+                valid_imgs_labels = h['valid_imgs_labels'][()]
+                valid_texts_labels = h['valid_texts_labels'][()]
+                valid_texts_labels -= np.min(valid_texts_labels)
+                valid_data = [valid_imgs_deep, valid_texts_idx]
+                valid_labels = [valid_imgs_labels, valid_texts_labels]
+
+            train_data = valid_data if mode == 'valid' else test_data
+            train_label = valid_labels if mode == 'valid' else test_labels
+        elif mode == 'train':
+            tr_img = h['train_imgs_deep'].astype(dtype)[()]
+            tr_img_lab = h['train_imgs_labels'][()]
+            tr_img_lab -= np.min(tr_img_lab)
+            try:
+                tr_txt = h['train_text'].astype(dtype)[()]
+            except Exception as e:
+                tr_txt = h['train_texts'].astype(dtype)[()]
+            tr_txt_lab = h['train_texts_labels'][()]
+            tr_txt_lab -= np.min(tr_txt_lab)
+            train_data = [tr_img, tr_txt]
+            train_label = [tr_img_lab, tr_txt_lab]
+        else:
+            raise Exception('Have no such set mode!')
+        h.close()
+    else:
+        import scipy.io as sio
+        data = sio.loadmat(path)
+        if 'xmedianet4view' in dataset.lower():
+            if mode == 'train':
+                train_data = [data['train'][0, v].astype(dtype) for v in range(4)]
+                train_label = [data['train_labels'][0, v].reshape([-1]).astype('int64') for v in range(4)]
+            elif mode == 'valid':
+                train_data = [data['valid'][0, v].astype(dtype) for v in range(4)]
+                train_label = [data['valid_labels'][0, v].reshape([-1]).astype('int64') for v in range(4)]
+            elif mode == 'test':
+                train_data = [data['test'][0, v].astype(dtype) for v in range(4)]
+                train_label = [data['test_labels'][0, v].reshape([-1]).astype('int64') for v in range(4)]
             else:
                 raise Exception('Have no such set mode!')
-            h.close()
         else:
-            data = sio.loadmat(path)
-            if 'xmedianet4view' in dataset.lower():
-                if self.mode == 'train':
-                    train_data = [data['train'][0, v].astype('float32') for v in range(4)]
-                    train_label = [data['train_labels'][0, v].reshape([-1]).astype('int64') for v in range(4)]
-                elif self.mode == 'valid':
-                    train_data = [data['valid'][0, v].astype('float32') for v in range(4)]
-                    train_label = [data['valid_labels'][0, v].reshape([-1]).astype('int64') for v in range(4)]
-                elif self.mode == 'test':
-                    train_data = [data['test'][0, v].astype('float32') for v in range(4)]
-                    train_label = [data['test_labels'][0, v].reshape([-1]).astype('int64') for v in range(4)]
-                else:
-                    raise Exception('Have no such set mode!')
+            if mode == 'train':
+                train_data = [data['tr_img'].astype(dtype), data['tr_txt'].astype(dtype)]
+                train_label = [data['tr_img_lab'].reshape([-1]).astype('int64'), data['tr_txt_lab'].reshape([-1]).astype('int64')]
+            elif mode == 'valid':
+                train_data = [data['val_img'].astype(dtype), data['val_txt'].astype(dtype)]
+                train_label = [data['val_img_lab'].reshape([-1]).astype('int64'), data['val_txt_lab'].reshape([-1]).astype('int64')]
+            elif mode == 'test':
+                train_data = [data['te_img'].astype(dtype), data['te_txt'].astype(dtype)]
+                train_label = [data['te_img_lab'].reshape([-1]).astype('int64'), data['te_txt_lab'].reshape([-1]).astype('int64')]
             else:
-                if self.mode == 'train':
-                    train_data = [data['tr_img'].astype('float32'), data['tr_txt'].astype('float32')]
-                    train_label = [data['tr_img_lab'].reshape([-1]).astype('int64'), data['tr_txt_lab'].reshape([-1]).astype('int64')]
-                elif self.mode == 'valid':
-                    train_data = [data['val_img'].astype('float32'), data['val_txt'].astype('float32')]
-                    train_label = [data['val_img_lab'].reshape([-1]).astype('int64'), data['val_txt_lab'].reshape([-1]).astype('int64')]
-                elif self.mode == 'test':
-                    train_data = [data['te_img'].astype('float32'), data['te_txt'].astype('float32')]
-                    train_label = [data['te_img_lab'].reshape([-1]).astype('int64'), data['te_txt_lab'].reshape([-1]).astype('int64')]
-                else:
-                    raise Exception('Have no such set mode!')
+                raise Exception('Have no such set mode!')
+    if sparse and not doc2vec:  # doc2vec text features are dense
+        from .sparse import sparsify
+        return [sparsify(d) if v == 1 else compact(d, storage) for v, d in enumerate(train_data)], train_label
+    return [compact(d, storage) for d in train_data], train_label
+
+
+def load_noise_labels(train_label, noisy_ratio, noise_mode, noise_file):
+    """
+    Read the noisy training labels from noise_file, or inject noise into train_label and save them there.
+    :return: per-view noisy labels and the number of classes
+    """
+    if os.path.exists(noise_file):
+        noise_label = json.load(open(noise_file, "r"))
+        return noise_label, np.unique(noise_label).shape[0]
+    #inject noise
+    noise_label = []
+    classes = np.unique(train_label[0])
+    class_num = classes.shape[0]
+    inx = np.arange(class_num)
+    np.random.shuffle(inx)
+    transition = {i: i for i in range(class_num)}
+    half_num = int(class_num // 2)
+    for i in range(half_num):
+        transition[inx[i]] = int(inx[half_num + i])
+    for v in range(len(train_label)):
+        noise_label_tmp = []
+        data_num = len(train_label[v])
+        idx = list(range(data_num))
+        random.shuffle(idx)
+        num_noise = int(noisy_ratio * data_num)
+        noise_idx = set(idx[:num_noise])
+        for i in range(data_num):
+            if i in noise_idx:
+                if noise_mode == 'sym':
+                    noiselabel = int(random.randint(0, class_num))
+                    noise_label_tmp.append(noiselabel)
+                elif noise_mode == 'asym':
+                    noiselabel = transition[train_label[v][i]]
+                    noise_label_tmp.append(noiselabel)
+            else:
+                noise_label_tmp.append(int(train_label[v][i]))
+        noise_label.append(noise_label_tmp)
+    # print("save noisy labels to %s ..." % noise_file)
+    json.dump(noise_label, open(noise_file, "w"))
+    return noise_label, class_num
+
+
+class cross_modal_dataset(data.Dataset):
+    def __init__(self, dataset, noisy_ratio, mode, noise_mode='sym', root_dir='data/', noise_file=None, pred=False, probability=[], log='', features=None, storage='float32', sparse=False):
+        self.r = noisy_ratio # noise ratio
+        self.mode = mode
+        if features is None:
+            train_data, train_label = load_features(dataset, mode, root_dir, storage, sparse)
+        else:  # preloaded (e.g. shared-memory) arrays, see sweep.py
+            train_data, train_label = features
+        root_dir = dataset_path(dataset, root_dir)[0]
 
         # if 'wiki' in dataset.lower() or 'nus' in dataset.lower():
         #     self.transition = {0: 0, 2: 0, 4: 7, 7: 7, 1: 1, 9: 1, 3: 5, 5: 3, 6: 6, 8: 8}
@@ -143,40 +259,7 @@ class cross_modal_dataset(data.Dataset):
             elif noise_mode == 'asym':
                 noise_file = os.path.join(root_dir, 'noise_labels_%g__asym.json' % self.r)
         if self.mode == 'train':
-            if os.path.exists(noise_file):
-                noise_label = json.load(open(noise_file, "r"))
-                self.class_num = np.unique(noise_label).shape[0]
-            else:    #inject noise
-                noise_label = []
-                classes = np.unique(train_label[0])
-                class_num = classes.shape[0]
-                self.class_num = class_num
-                inx = np.arange(class_num)
-                np.random.shuffle(inx)
-                self.transition = {i: i for i in range(class_num)}
-                half_num = int(class_num // 2)
-                for i in range(half_num):
-                    self.transition[inx[i]] = int(inx[half_num + i])
-                for v in range(len(train_data)):
-                    noise_label_tmp = []
-                    data_num = train_data[v].shape[0]
-                    idx = list(range(data_num))
-                    random.shuffle(idx)
-                    num_noise = int(self.r * data_num)
-                    noise_idx = idx[:num_noise]
-                    for i in range(data_num):
-                        if i in noise_idx:
-                            if noise_mode == 'sym':
-                                noiselabel = int(random.randint(0, class_num))
-                                noise_label_tmp.append(noiselabel)
-                            elif noise_mode == 'asym':
-                                noiselabel = self.transition[train_label[v][i]]
-                                noise_label_tmp.append(noiselabel)
-                        else:
-                            noise_label_tmp.append(int(train_label[v][i]))
-                    noise_label.append(noise_label_tmp)
-                # print("save noisy labels to %s ..." % noise_file)
-                json.dump(noise_label, open(noise_file, "w"))
+            noise_label, self.class_num = load_noise_labels(train_label, self.r, noise_mode, noise_file)
 
         self.default_train_data = train_data
         self.default_noise_label = np.array(noise_label)
@@ -194,7 +277,7 @@ class cross_modal_dataset(data.Dataset):
             self.noise_label = self.default_noise_label
         elif mode == 'labeled':
             inx = np.stack(pred).sum(0) > 0.5
-            self.train_data = [dd[inx] for dd in self.default_train_data]
+            self.train_data = [dd.subset(inx) if isinstance(dd, CompactArray) else dd[inx] for dd in self.default_train_data]
             self.noise_label = [dd[inx] for dd in self.default_noise_label]
             probs = np.stack(prob)[:, inx]
             prob_inx = probs.argmax(0)
@@ -204,7 +287,7 @@ class cross_modal_dataset(data.Dataset):
             self.prob = [prob, prob]
         elif mode == 'unlabeled':
             inx = np.stack(pred).sum(0) <= 0.5
-            self.train_data = [dd[inx] for dd in self.default_train_data]
+            self.train_data = [dd.subset(inx) if isinstance(dd, CompactArray) else dd[inx] for dd in self.default_train_data]
             self.noise_label = [dd[inx] for dd in self.default_noise_label]
             self.prob = [dd[inx] for dd in prob]
         else:
@@ -0,0 +1,85 @@
+import numpy as np
+
+
+def _normalize(x, axis=1):
+    x = np.asarray(x, dtype='float32')
+    return x / np.linalg.norm(x, axis=axis, keepdims=True)
+
+
+class ClassPartitionIndex(object):
+    """
+    Gallery partitioned by the classes predicted with the learned prototypes C. A query probes the partitions
+    of its top-m predicted classes only, or scans the whole gallery when its top-1 probability is below
+    min_confidence.
+    """
+
+    def __init__(self, gallery, C, assign=1, tau=1.):
+        """
+        :param gallery: embeddings of the gallery
+        :param C: class prototypes (output_dim x class_num) of the checkpoint
+        :param assign: put every gallery item in the partitions of its top-assign classes
+        :param tau: temperature of the class probabilities, that of the training loss
+        """
+        self.gallery = _normalize(gallery)
+        self.C = _normalize(C, axis=0)
+        self.tau = tau
+        top = np.argsort(-self.gallery.dot(self.C), 1)[:, :assign]
+        self.partitions = [np.flatnonzero((top == c).any(1)) for c in range(self.C.shape[1])]
+
+    def probability(self, queries):
+        logits = queries.dot(self.C) / self.tau
+        logits -= logits.max(1, keepdims=True)
+        prob = np.exp(logits)
+        return prob / prob.sum(1, keepdims=True)
+
+    def _rank(self, queries, candidates):
+        dist = 1. - queries.dot(self.gallery[candidates].T)
+        return candidates[dist.argsort(1)]
+
+    def search(self, queries, m=1, min_confidence=0.):
+        """
+        Rank the probed gallery items of every query, queries sharing the same probed classes in one product.
+        :return: list of (query rows, ranked gallery indices of these rows) and the number of distances computed
+        """
+        queries = _normalize(queries)
+        prob = self.probability(queries)
+        probes = np.sort(np.argsort(-prob, 1)[:, :m], 1)
+        fallback = prob.max(1) < min_confidence
+        results, scanned = [], 0
+        if fallback.any():
+            rows = np.flatnonzero(fallback)
+            results.append((rows, self._rank(queries[rows], np.arange(self.gallery.shape[0]))))
+            scanned += len(rows) * self.gallery.shape[0]
+        probed_rows = np.flatnonzero(~fallback)
+        if len(probed_rows) == 0:
+            return results, scanned
+        keys, inverse = np.unique(probes[probed_rows], axis=0, return_inverse=True)
+        order = np.argsort(inverse.reshape(-1), kind='stable')
+        groups = np.split(probed_rows[order], np.cumsum(np.bincount(inverse.reshape(-1), minlength=len(keys)))[:-1])
+        for key, rows in zip(keys, groups):
+            candidates = np.unique(np.concatenate([self.partitions[c] for c in key]))
+            if len(candidates) == 0:
+                results.append((rows, np.zeros([len(rows), 0], dtype='int64')))
+                continue
+            results.append((rows, self._rank(queries[rows], candidates)))
+            scanned += len(rows) * len(candidates)
+        return results, scanned
+
+
+def partition_map(results, test_label, train_labels):
+    """
+    MAP of a partitioned search: the relevant items that were not probed count as never retrieved,
+    so AP divides by all the relevant items of the gallery.
+    """
+    test_label, train_labels = np.asarray(test_label).reshape(-1), np.asarray(train_labels).reshape(-1)
+    classes, counts = np.unique(train_labels, return_counts=True)
+    num_positives = dict(zip(classes.tolist(), counts.tolist()))
+    res = np.zeros(test_label.shape[0])
+    for rows, ranked in results:
+        if ranked.shape[1] == 0:
+            continue
+        rel = train_labels[ranked] == test_label[rows, None]
+        p = (rel.cumsum(1) / np.arange(1., ranked.shape[1] + 1) * rel).sum(1)
+        total = np.array([num_positives.get(c, 0) for c in test_label[rows].tolist()])
+        res[rows] = np.where(total > 0, p / np.maximum(total, 1), 0.)
+    return res.mean()
@@ -0,0 +1,25 @@
+import csv
+import os
+
+
+def split_args(parser):
+    """
+    Parse the options of a script, the remaining ones (after an optional --) being those of main_noisy.py.
+    :return: the script options and the argv to give to get_config
+    """
+    args, config_argv = parser.parse_known_args()
+    if config_argv[:1] == ['--']:
+        config_argv = config_argv[1:]
+    return args, config_argv
+
+
+def append_report(path, rows):
+    """
+    Append rows (dicts with the same keys) to a CSV report, writing the header when the file is new.
+    """
+    exists = os.path.exists(path)
+    with open(path, 'a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+        if not exists:
+            writer.writeheader()
+        writer.writerows(rows)
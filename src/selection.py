@@ -0,0 +1,61 @@
+import numpy as np
+
+
+def clean_probability(loss, iters=10, reg=1e-3):
+    """
+    Fit a two-component 1-D Gaussian mixture to the per-sample losses and
+    return the posterior of the low-loss (clean) component.
+    """
+    loss = (loss - loss.min()) / (loss.max() - loss.min() + 1e-8)
+    mu = np.array([0., 1.])
+    var = np.array([0.1, 0.1])
+    pi = np.array([0.5, 0.5])
+    for _ in range(iters):
+        # E step
+        lik = pi / np.sqrt(2 * np.pi * var) * np.exp(-(loss[:, None] - mu) ** 2 / (2 * var))
+        resp = lik / (lik.sum(1, keepdims=True) + 1e-12)
+        # M step
+        nk = resp.sum(0) + 1e-12
+        mu = (resp * loss[:, None]).sum(0) / nk
+        var = (resp * (loss[:, None] - mu) ** 2).sum(0) / nk + reg
+        pi = nk / nk.sum()
+    return resp[:, mu.argmin()].astype('float32')
+
+
+class SampleSelector(object):
+    """
+    Track an exponential moving average of the per-sample loss of every view and
+    select the probably-clean samples to train on.
+    """
+
+    def __init__(self, n_view, num_samples, momentum=0.9):
+        self.momentum = momentum
+        self.loss = np.zeros([n_view, num_samples], dtype='float32')
+        self.seen = np.zeros([n_view, num_samples], dtype=bool)
+        self.active = np.arange(num_samples)
+
+    def inactive(self):
+        mask = np.ones(self.loss.shape[1], dtype=bool)
+        mask[self.active] = False
+        return np.nonzero(mask)[0]
+
+    def update(self, v, index, loss, active=True):
+        """
+        :param index: sample indices as returned by the loader, i.e. positions in the active subset
+                      if active is True and positions in the full dataset otherwise
+        """
+        index = self.active[index] if active else index
+        seen = self.seen[v, index]
+        self.loss[v, index] = np.where(seen, self.momentum * self.loss[v, index] + (1. - self.momentum) * loss, loss)
+        self.seen[v, index] = True
+
+    def select(self, threshold=0.5):
+        """
+        Return per-view (pred, prob) for cross_modal_dataset.reset(pred, prob, 'labeled'). A sample is kept
+        if any view is clean with a probability above threshold; 0.5 keeps the probably-clean samples
+        while a small threshold only skips the confidently-noisy ones.
+        """
+        prob = [clean_probability(self.loss[v]) for v in range(self.loss.shape[0])]
+        pred = [p > threshold for p in prob]
+        self.active = np.nonzero(np.stack(pred).sum(0) > 0.5)[0]
+        return pred, prob
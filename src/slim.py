@@ -0,0 +1,77 @@
+import json
+
+import numpy as np
+import torch
+
+MAGIC = b'MRLSLIM1'
+ALIGN = 64
+
+
+def _align(offset):
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+def save_slim(path, multi_models, C, dtype='float32', **info):
+    """
+    Write an inference-only artifact: the per-view encoder weights and the prototypes C, without the optimizer state.
+    Layout: MAGIC, header length (uint64), JSON header, then every tensor at a 64-byte aligned offset.
+    :param dtype: float32 or float16 storage of the tensors
+    """
+    tensors = {'C': C.detach().cpu()}
+    models = []
+    for v, model in enumerate(multi_models):
+        models.append({'arch': type(model).__name__, 'input_dim': model.fc1.in_features, 'output_dim': model.fc3.out_features,
+                       'mid_num': [model.fc1.out_features, model.fc2.out_features]})
+        for key, value in model.state_dict().items():
+            tensors['%d.%s' % (v, key)] = value.detach().cpu()
+    arrays, entries, offset = [], {}, 0
+    for name, value in tensors.items():
+        array = np.ascontiguousarray(value.float().numpy().astype(dtype))
+        offset = _align(offset)
+        entries[name] = {'dtype': array.dtype.name, 'shape': list(array.shape), 'offset': offset}
+        arrays.append((offset, array))
+        offset += array.nbytes
+    info.update(models=models, tensors=entries)
+    header = json.dumps(info).encode('utf-8')
+    start = _align(len(MAGIC) + 8 + len(header))  # tensor offsets are relative to the aligned data start
+    with open(path, 'wb') as f:
+        f.write(MAGIC + np.uint64(len(header)).tobytes() + header)
+        for rel, array in arrays:
+            f.seek(start + rel)
+            f.write(array.tobytes())
+        f.truncate(start + offset)
+
+
+def read_header(path):
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise Exception('%s is not a slim checkpoint.' % path)
+        length = int(np.frombuffer(f.read(8), dtype='uint64')[0])
+        header = json.loads(f.read(length).decode('utf-8'))
+    return header, _align(len(MAGIC) + 8 + length)
+
+
+def load_slim(path, dtype=None):
+    """
+    Load the encoders and C of a slim artifact without copying the weights: tensors are views of a copy-on-write
+    memory map, so processes loading the same file share the page cache. Needs torch >= 2.1 (meta device, assign).
+    :param dtype: cast the weights (e.g. torch.float32 for a float16 file), which copies them
+    :return: the per-view encoders on the CPU in eval mode, C and the header
+    """
+    import nets as models
+    header, start = read_header(path)
+    buffer = np.memmap(path, mode='c')
+    tensors = {}
+    for name, entry in header['tensors'].items():
+        count = int(np.prod(entry['shape']))
+        array = np.frombuffer(buffer, dtype=entry['dtype'], count=count, offset=start + entry['offset']).reshape(entry['shape'])
+        tensor = torch.from_numpy(array)
+        tensors[name] = tensor if dtype is None else tensor.to(dtype)
+    multi_models = []
+    for v, spec in enumerate(header['models']):
+        with torch.device('meta'):
+            model = models.__dict__[spec['arch']](input_dim=spec['input_dim'], output_dim=spec['output_dim'], mid_num=tuple(spec['mid_num']))
+        prefix = '%d.' % v
+        model.load_state_dict({k[len(prefix):]: t for k, t in tensors.items() if k.startswith(prefix)}, assign=True)
+        multi_models.append(model.eval())
+    return multi_models, tensors['C'], header
@@ -0,0 +1,30 @@
+import numpy as np
+import torch
+from torch.utils.data.dataloader import default_collate
+
+
+def is_sparse(x):
+    return hasattr(x, 'tocoo')
+
+
+def sparsify(x):
+    """Bag-of-words features as a float32 scipy CSR matrix."""
+    import scipy.sparse as sp
+    return sp.csr_matrix(x, dtype='float32')
+
+
+def to_tensor(x):
+    """Rows of a feature matrix as a float32 tensor, a sparse COO tensor for a scipy sparse matrix."""
+    if is_sparse(x):
+        coo = x.tocoo()
+        indices = torch.from_numpy(np.vstack([coo.row, coo.col]).astype('int64'))
+        return torch.sparse_coo_tensor(indices, torch.from_numpy(coo.data.astype('float32')), coo.shape)
+    return torch.from_numpy(np.asarray(x, dtype='float32'))
+
+
+def sparse_collate(batch):
+    """default_collate for cross_modal_dataset samples, stacking the CSR rows of a sparse view into one sparse tensor."""
+    import scipy.sparse as sp
+    views = [[sample[0][v] for sample in batch] for v in range(len(batch[0][0]))]
+    views = [to_tensor(sp.vstack(rows, format='csr')) if is_sparse(rows[0]) else default_collate(rows) for rows in views]
+    return [views] + list(default_collate([sample[1:] for sample in batch]))
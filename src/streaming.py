@@ -0,0 +1,158 @@
+import os
+import queue
+import threading
+
+import numpy as np
+import torch.utils.data as data
+
+from .noisydataset import dataset_path, load_noise_labels
+
+
+class DiskArray(object):
+    """
+    A 2-D feature matrix left on disk, an HDF5 dataset (path, key) or a .npy file (path, None), read on slicing.
+    The file is opened lazily, so the array can be sent to DataLoader workers.
+    """
+
+    def __init__(self, path, key=None):
+        self.path = path
+        self.key = key
+        self._data = None
+        self.shape = tuple(self.data.shape)
+        self._data = None  # reopened where it is read, e.g. in a DataLoader worker
+
+    @property
+    def data(self):
+        if self._data is None:
+            if self.key is None:
+                self._data = np.load(self.path, mmap_mode='r')
+            else:
+                import h5py
+                self._data = h5py.File(self.path, 'r')[self.key]
+        return self._data
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, index):
+        return np.asarray(self.data[index], dtype='float32')
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_data'] = None
+        return state
+
+
+class StreamingDataset(data.IterableDataset):
+    """
+    Stream paired samples of all views from disk in chunks, with a bounded shuffle buffer and a background
+    thread reading ahead. Chunks are sharded across DataLoader workers. Yields the
+    ([view features], [view labels], index) samples of cross_modal_dataset, index being the row in the file.
+    Memory holds at most read_ahead + 1 chunks and shuffle_buffer samples, whatever the number of samples.
+    """
+
+    def __init__(self, train_data, noise_label, chunk_size=4096, shuffle_buffer=16384, read_ahead=2, shuffle=True, seed=0):
+        """
+        :param train_data: per-view DiskArray (or any array sliced by rows)
+        :param noise_label: per-view training labels
+        """
+        self.train_data = train_data
+        self.noise_label = [np.asarray(lab, dtype='int64') for lab in noise_label]
+        self.chunk_size = chunk_size
+        self.shuffle_buffer = shuffle_buffer
+        self.read_ahead = read_ahead
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = max(epoch, 0)  # the -1 warm-up pass of main_noisy.py reads the epoch 0 order, RandomState needs seeds >= 0
+
+    def __len__(self):
+        return len(self.train_data[0])
+
+    def _chunks(self):
+        starts = np.arange(0, len(self), self.chunk_size)
+        if self.shuffle:
+            np.random.RandomState(self.seed + self.epoch).shuffle(starts)
+        worker_info = data.get_worker_info()
+        if worker_info is not None:
+            starts = starts[worker_info.id::worker_info.num_workers]
+        return starts
+
+    def _read(self, starts, out, stop):
+        for start in starts:
+            end = min(start + self.chunk_size, len(self))
+            chunk = (start, [d[start: end] for d in self.train_data])
+            while not stop.is_set():
+                try:
+                    out.put(chunk, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+            if stop.is_set():
+                return
+        out.put(None)
+
+    def __iter__(self):
+        chunks, stop = queue.Queue(maxsize=self.read_ahead), threading.Event()
+        reader = threading.Thread(target=self._read, args=(self._chunks(), chunks, stop), daemon=True)
+        reader.start()
+        worker_info = data.get_worker_info()
+        rng = np.random.RandomState(self.seed + self.epoch + (0 if worker_info is None else 1000 * (worker_info.id + 1)))
+        buffer = []
+        try:
+            while True:
+                chunk = chunks.get()
+                if chunk is None:
+                    break
+                start, rows = chunk
+                for i in range(rows[0].shape[0]):
+                    index = start + i
+                    sample = ([r[i] for r in rows], [lab[index] for lab in self.noise_label], index)
+                    if not self.shuffle:
+                        yield sample
+                        continue
+                    buffer.append(sample)
+                    if len(buffer) >= self.shuffle_buffer:
+                        j = rng.randint(len(buffer))
+                        buffer[j], buffer[-1] = buffer[-1], buffer[j]
+                        yield buffer.pop()
+            rng.shuffle(buffer)
+            for sample in buffer:
+                yield sample
+        finally:
+            # the consumer may stop early (max_steps, a dropped iterator): release the reader and its chunks
+            stop.set()
+            while reader.is_alive():
+                try:
+                    chunks.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            reader.join()
+
+
+def cross_modal_stream(dataset, noisy_ratio, noise_mode='sym', root_dir='data/', noise_file=None, **kwargs):
+    """
+    Streaming counterpart of cross_modal_dataset(dataset, noisy_ratio, 'train') for the HDF5 datasets;
+    only the labels are loaded into memory.
+    """
+    import h5py
+    root_dir, path, doc2vec, valid_len = dataset_path(dataset, root_dir)
+    if not doc2vec:
+        raise Exception('Streaming needs an HDF5 dataset, %s is a .mat file.' % path)
+    with h5py.File(path, 'r') as h:
+        txt_key = 'train_text' if 'train_text' in h else 'train_texts'
+        train_label = []
+        for key in ['train_imgs_labels', 'train_texts_labels']:
+            lab = h[key][()]
+            train_label.append((lab - np.min(lab)).reshape([-1]).astype('int64'))
+    if noise_file is None:
+        if noise_mode == 'sym':
+            noise_file = os.path.join(root_dir, 'noise_labels_%g_sym.json' % noisy_ratio)
+        elif noise_mode == 'asym':
+            noise_file = os.path.join(root_dir, 'noise_labels_%g__asym.json' % noisy_ratio)
+    noise_label, class_num = load_noise_labels(train_label, noisy_ratio, noise_mode, noise_file)
+    stream = StreamingDataset([DiskArray(path, 'train_imgs_deep'), DiskArray(path, txt_key)], noise_label, **kwargs)
+    stream.class_num = class_num
+    return stream
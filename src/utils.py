@@ -133,10 +133,11 @@ class MeanClusteringError(nn.Module):
     Mean Absolute Error
     """
 
-    def __init__(self, num_classes, tau=1):
+    def __init__(self, num_classes, tau=1, reduction='mean'):
         super(MeanClusteringError, self).__init__()
         self.register_buffer('embedding', torch.eye(num_classes))
         self.tau = tau
+        self.reduction = reduction
 
     def to_onehot(self, target):
         return self.embedding[target]
@@ -145,4 +146,52 @@ class MeanClusteringError(nn.Module):
         pred = F.softmax(input / self.tau, dim=1)
         q = self.to_onehot(target).detach()
         p = ((1. - q) * pred).sum(1) / pred.sum(1)
+        if self.reduction == 'none':
+            return p.log()
         return (p.log()).mean()
+
+
+def cross_modal_contrastive_ctriterion(fea, tau=1., memory_bank=None, index=None):
+    """
+    Multimodal contrastive loss over the per-view embeddings of a batch.
+    :param memory_bank: optional src.memory_bank.MemoryBank of extra negatives
+    :param index: sample indices of the batch, masks the bank entries of the same samples
+    """
+    n_view = len(fea)
+    batch_size = fea[0].shape[0]
+    all_fea = torch.cat(fea)
+    sim = all_fea.mm(all_fea.t())
+
+    sim = (sim / tau).exp()
+    sim = sim - sim.diag().diag()
+    sim_sum = sim.sum(1)
+    if memory_bank is not None and index is not None:
+        # past embeddings as extra negatives, except those of the same samples
+        bank, bank_index = memory_bank.negatives()
+        neg = (all_fea.mm(bank.t()) / tau).exp()
+        neg = neg * (bank_index.view(1, -1) != index.repeat(n_view).view(-1, 1)).float()
+        sim_sum = sim_sum + neg.sum(1)
+    sim_sum1 = sum([sim[:, v * batch_size: (v + 1) * batch_size] for v in range(n_view)])
+    diag1 = torch.cat([sim_sum1[v * batch_size: (v + 1) * batch_size].diag() for v in range(n_view)])
+    loss1 = -(diag1 / sim_sum).log().mean()
+
+    sim_sum2 = sum([sim[v * batch_size: (v + 1) * batch_size] for v in range(n_view)])
+    diag2 = torch.cat([sim_sum2[:, v * batch_size: (v + 1) * batch_size].diag() for v in range(n_view)])
+    loss2 = -(diag2 / sim_sum).log().mean()
+    return loss1 + loss2
+
+
+def prefix(fea, dim):
+    """L2-normalized first dim coordinates of the embeddings."""
+    return F.normalize(fea[:, :dim], dim=1)
+
+
+def nested_loss(outputs, C, targets, dim, criterion, beta=0.5, tau=1.):
+    """
+    Classification and contrastive losses of the dim-dimensional prefix of the per-view embeddings,
+    the prototypes C being cut to the same prefix.
+    """
+    fea = [prefix(o, dim) for o in outputs]
+    C = F.normalize(C[:dim], dim=0)
+    loss = sum([criterion(fea[v].mm(C), targets[v]) for v in range(len(fea))])
+    return beta * loss + (1. - beta) * cross_modal_contrastive_ctriterion(fea, tau=tau)
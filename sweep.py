@@ -0,0 +1,156 @@
+import argparse
+import contextlib
+import csv
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import torch
+import torch.multiprocessing as mp
+
+from src.noisydataset import CompactArray, cross_modal_dataset, load_features
+from src.report import split_args
+from src.sparse import is_sparse
+from utils.config import get_config
+
+# Sweep a grid of main_noisy.py configurations over a pool of worker processes.
+# Every dataset is read from disk once, moved to shared memory, and handed to all workers,
+# so each run only pays for building its models.
+#
+# python sweep.py --grid noisy_ratio=0.2,0.4,0.6,0.8 beta=0.5,0.7 --processes 4 --threads 2 --gpus 0,1 \
+#     -- --max_epochs 30 --loss MCE --lr 0.0001 --train_batch_size 100 --data_name wiki
+parser = argparse.ArgumentParser(description='MRL hyperparameter sweep')
+parser.add_argument('--grid', nargs='+', default=[], help='key=v1,v2,... for any option of utils/config.py')
+parser.add_argument('--processes', type=int, default=1, help='number of concurrent runs')
+parser.add_argument('--threads', type=int, default=1, help='torch threads per worker process')
+parser.add_argument('--gpus', type=str, default='', help='comma separated GPU ids assigned round-robin to workers')
+parser.add_argument('--output', type=str, default='sweep_results.csv')
+
+_features = {}
+
+
+def parse_grid(grid):
+    keys, values = [], []
+    for item in grid:
+        key, vals = item.split('=', 1)
+        keys.append(key.lstrip('-'))
+        values.append(vals.split(','))
+    return [list(zip(keys, combo)) for combo in itertools.product(*values)]
+
+
+def run_name(base, combo):
+    return '_'.join([base] + ['%s%s' % (k, v) for k, v in combo])
+
+
+def share(x):
+    if isinstance(x, CompactArray):
+        return CompactArray(share(x.data), x.codec, x.scale, x.offset)
+    if is_sparse(x):  # --sparse_text: the CSR parts are shared
+        x = x.tocsr()
+        return ('csr', x.shape, share(x.data), share(x.indices), share(x.indptr))
+    return torch.from_numpy(x).share_memory_()
+
+
+def unshare(x):
+    if isinstance(x, CompactArray):
+        return CompactArray(unshare(x.data), x.codec, x.scale, x.offset)
+    if isinstance(x, tuple):
+        import scipy.sparse as sp
+        _, shape, data, indices, indptr = x
+        return sp.csr_matrix((unshare(data), unshare(indices), unshare(indptr)), shape=shape, copy=False)
+    return x.numpy()
+
+
+def share_features(datasets):
+    shared = {}
+    for data_name, storage, sparse in datasets:
+        for mode in ['train', 'valid', 'test']:
+            train_data, train_label = load_features(data_name, mode, storage=storage, sparse=sparse)
+            shared[(data_name, storage, sparse, mode)] = ([share(d) for d in train_data], [share(l) for l in train_label])
+            del train_data, train_label
+    return shared
+
+
+def as_numpy(shared_features):
+    train_data, train_label = shared_features
+    return [unshare(d) for d in train_data], [unshare(l) for l in train_label]
+
+
+def init_worker(shared, threads, gpus):
+    ident = mp.current_process()._identity
+    if gpus and ident:
+        os.environ['CUDA_VISIBLE_DEVICES'] = gpus[(ident[0] - 1) % len(gpus)]
+    torch.set_num_threads(threads)
+    for key, value in shared.items():
+        _features[key] = as_numpy(value)
+
+
+def run(config):
+    import main_noisy
+    log_dir = os.path.join(config.root_dir, 'logs', config.log_name)
+    os.makedirs(log_dir, exist_ok=True)
+
+    features = {mode: _features[(config.data_name, config.storage_dtype, config.sparse_text, mode)] for mode in ['train', 'valid', 'test']}
+    start = time.time()
+    with open(os.path.join(log_dir, 'stdout.txt'), 'w') as f, contextlib.redirect_stdout(f):
+        test_dict = main_noisy.main(config, features)
+    return test_dict, time.time() - start
+
+
+def main():
+    sweep_args, base_argv = split_args(parser)
+
+    combos = parse_grid(sweep_args.grid)
+    runs = []
+    for combo in combos:
+        config = get_config(base_argv + sum([['--' + k, v] for k, v in combo], []))
+        # every run logs, checkpoints and exports its features to its own path
+        config.log_name = config.ckpt_dir = run_name(config.log_name, combo)
+        config.export_name = run_name(config.export_name or '%s_%g' % (config.data_name, config.noisy_ratio), combo)
+        runs.append((combo, config))
+
+    datasets = sorted(set((c.data_name, c.storage_dtype, c.sparse_text) for _, c in runs))
+    print('===> Loading %s into shared memory ..' % ', '.join('%s (%s%s)' % (d, s, ', sparse text' if t else '') for d, s, t in datasets))
+    shared = share_features(datasets)
+
+    # write the noise label files once, before the workers race to create them
+    for data_name, storage, sparse, noisy_ratio in sorted(set((c.data_name, c.storage_dtype, c.sparse_text, c.noisy_ratio) for _, c in runs)):
+        cross_modal_dataset(data_name, noisy_ratio, 'train', features=as_numpy(shared[(data_name, storage, sparse, 'train')]))
+
+    gpus = [g for g in sweep_args.gpus.split(',') if g]
+    rows, fields = [], []
+    with ProcessPoolExecutor(max_workers=sweep_args.processes, mp_context=mp.get_context('spawn'),
+                             initializer=init_worker, initargs=(shared, sweep_args.threads, gpus)) as pool:
+        futures = {}
+        for combo, config in runs:
+            futures[pool.submit(run, config)] = (config.log_name, combo)
+        for future in as_completed(futures):
+            name, combo = futures[future]
+            row = dict(combo)
+            try:
+                test_dict, elapsed = future.result()
+            except Exception as e:
+                # a failed run keeps its row, the others are still written
+                row.update(status='error', error=repr(e))
+                print('%s: failed, %r' % (name, e))
+            else:
+                row.update(test_dict)
+                row.update(time=elapsed, status='ok')
+                print('%s: avg %.4f (%.0fs)' % (name, test_dict['avg'], elapsed))
+            rows.append(row)
+            fields += [k for k in row if k not in fields]
+
+    keys = [k for k, _ in combos[0]]
+    rows.sort(key=lambda row: [str(row[k]) for k in keys])
+    with open(sweep_args.output, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
+    print('\t'.join(fields))
+    for row in rows:
+        print('\t'.join(('%.4f' % row[k]) if isinstance(row.get(k), float) else str(row.get(k, '')) for k in fields))
+
+
+if __name__ == '__main__':
+    main()
@@ -21,11 +21,19 @@ def get_mean_and_std(dataset):
     std.div_(len(dataset))
     return mean, std
 
-try:
-    _, term_width = os.popen('stty size', 'r').read().split()
-except Exception as e:
-    term_width = 1e4
-term_width = int(term_width)
+term_width = None
+
+
+def get_term_width():
+    # queried on the first progress bar rather than at import
+    global term_width
+    if term_width is None:
+        try:
+            _, width = os.popen('stty size', 'r').read().split()
+        except Exception as e:
+            width = 1e4
+        term_width = int(width)
+    return term_width
 
 # term_width = 1000
 
@@ -36,6 +44,7 @@ begin_time = last_time
 
 def progress_bar(current, total, msg=None):
     global last_time, begin_time
+    term_width = get_term_width()
     if current == 0:
         begin_time = time.time()  # Reset for new bar.
 
@@ -1,4 +1,5 @@
 import argparse
+import json
 # Training settings
 parser = argparse.ArgumentParser(description='dorefa-net implementation')
 
@@ -16,18 +17,73 @@ parser.add_argument('--train_batch_size', type=int, default=100)
 parser.add_argument('--eval_batch_size', type=int, default=200)
 parser.add_argument('--max_epochs', type=int, default=100)
 parser.add_argument('--num_workers', type=int, default=0)
+parser.add_argument('--threads', type=int, default=0, help='torch threads (0: torch default)')
+parser.add_argument('--streaming', action='store_true', help='stream the training set from disk instead of loading it (HDF5 datasets)')
+parser.add_argument('--stream_chunk_size', type=int, default=4096, help='rows read at once per view when streaming')
+parser.add_argument('--stream_buffer', type=int, default=16384, help='samples in the streaming shuffle buffer')
+parser.add_argument('--stream_read_ahead', type=int, default=2, help='chunks read ahead by the background reader')
+parser.add_argument('--storage_dtype', type=str, default='float32', help='in-memory features: float32 float16 bfloat16 uint8 (per-feature scale)')
+parser.add_argument('--sparse_text', action='store_true', help='keep the bag-of-words text of the .mat datasets sparse (CSR) from disk to the first layer of TextNet')
 parser.add_argument('--resume', default='', type=str, metavar='PATH', help='path to latest checkpoint (default: none)')
 parser.add_argument('--ls', type=str, default='cos', help='lr scheduler')
 parser.add_argument('--loss', type=str, default='CE', help='CE RCE MAE') # MCE
 parser.add_argument('--output_dim', type=int, default=512, help='output shape')
+parser.add_argument('--nested_dims', type=int, nargs='*', default=[], help='also train these prefix sizes of the embedding, e.g. 64 128 256')
+parser.add_argument('--mid_num', type=int, default=4096, help='width of the hidden layers of the view encoders')
 parser.add_argument('--noisy_ratio', type=float, default=0.6) # 0.2 0.4 0.6 0.8
 parser.add_argument('--beta', type=float, default=0.5)
 parser.add_argument('--tau', type=float, default=1.)
 parser.add_argument('--optimizer', type=str, default='Adam')
+parser.add_argument('--bank_size', type=int, default=0, help='past embeddings per view used as extra contrastive negatives (0: in-batch negatives only)')
+parser.add_argument('--bank_staleness', type=int, default=0, help='ignore bank entries older than this many steps (0: no limit)')
+parser.add_argument('--eval_processes', type=int, default=0, help='processes computing the retrieval MAPs of the view pairs (0: in the main process)')
+parser.add_argument('--async_eval', action='store_true', help='evaluate the valid and test splits in a background process while training goes on')
+parser.add_argument('--async_eval_device', type=str, default='cpu', help='device of the background evaluation')
+parser.add_argument('--async_eval_pending', type=int, default=2, help='epochs awaiting evaluation before training waits')
+parser.add_argument('--embedding_cache', type=int, default=12, help='number of encoded (split, view) entries kept in memory')
+parser.add_argument('--embedding_cache_dir', type=str, default='', help='also persist encoded splits to this directory')
+parser.add_argument('--slim_dtype', type=str, default='', help='float32 or float16: also save the best encoders and C as an inference-only .slim file')
+parser.add_argument('--export_format', type=str, default='mat', help='mat: features/<data>_<ratio>.mat, npy: memory-mappable .npy files, h5: chunked and compressed HDF5')
+parser.add_argument('--export_name', type=str, default='', help='exported file or directory under features/ (default: <data_name>_<noisy_ratio>)')
+parser.add_argument('--export_splits', nargs='+', default=['test'], help='splits exported by the npy and h5 formats')
+parser.add_argument('--export_fp16', action='store_true', help='export the npy and h5 features as float16')
+parser.add_argument('--select_interval', type=int, default=0, help='re-select clean samples every n epochs (0: train on all samples)')
+parser.add_argument('--select_warmup', type=int, default=10, help='epochs on the full training set before the first selection')
+parser.add_argument('--select_threshold', type=float, default=0.5, help='clean probability to keep a sample; lower values only skip confidently-noisy samples')
+parser.add_argument('--select_momentum', type=float, default=0.9, help='moving average of the per-sample loss')
+parser.add_argument('--benchmark_steps', type=int, default=0, help='only time this many training steps and a test encode, see autotune.py')
+parser.add_argument('--config_file', type=str, default='', help='JSON of option values, e.g. written by autotune.py; the command line takes precedence')
 parser.add_argument('--views', nargs='+', help='<Required> Quantization bits', default=['Img', 'Txt', 'Audio', '3D', 'Video']) #Img, Txt, Audio, 3D, Video
 
-args = parser.parse_args()
-print(args)
+
+
+def get_config(argv=None, **overrides):
+    """
+    Build the run configuration from argv (sys.argv[1:] if None, [] for the defaults) and keyword overrides,
+    e.g. get_config([], data_name='inria', noisy_ratio=0.2).
+    """
+    config_file = parser.parse_known_args(argv)[0].config_file
+    if config_file:
+        # options already set on the namespace are not overwritten by the parser defaults
+        with open(config_file) as f:
+            config = parser.parse_args(argv, namespace=argparse.Namespace(**json.load(f)))
+    else:
+        config = parser.parse_args(argv)
+    for key, value in overrides.items():
+        if not hasattr(config, key):
+            raise AttributeError('No such option: %s' % key)
+        setattr(config, key, value)
+    return config
+
+
+def __getattr__(name):
+    # `from utils.config import args` parses the command line on first use only
+    if name == 'args':
+        global args
+        args = get_config()
+        print(args)
+        return args
+    raise AttributeError(name)
 
 # --max_epochs 100 --log_name noisylabel_se --loss CE  --lr 0.05 --train_batch_size 50 --beta 1
 # --max_epochs 50 --log_name noisylabel_mce --loss MCE  --lr 0.05 --train_batch_size 50 --beta 0.7 --noisy_ratio 0.2 --data_name wiki